@@ -6,8 +6,10 @@ import os
 from datetime import datetime
 from typing import List, Dict
 import streamlit as st
-from langchain_groq import ChatGroq
-from config import GROQ_API_KEY, MODEL_NAME
+from config import MODEL_NAME
+from rag_chain import get_chat_model
+from index_registry import get_index_registry
+from ingest_jobs import get_ingest_queue
 
 
 class QuizGenerator:
@@ -15,7 +17,7 @@ class QuizGenerator:
     
     def __init__(self, vectorstore):
         self.vectorstore = vectorstore
-        self.llm = ChatGroq(groq_api_key=GROQ_API_KEY, model_name=MODEL_NAME, temperature=0.7)
+        self.llm = get_chat_model(MODEL_NAME, temperature=0.7)
     
     def generate_mcq(self, num_questions: int = 5, difficulty: str = "medium") -> List[Dict]:
         """Generate multiple choice questions"""
@@ -203,7 +205,7 @@ class SmartSuggestions:
     
     def __init__(self, vectorstore):
         self.vectorstore = vectorstore
-        self.llm = ChatGroq(groq_api_key=GROQ_API_KEY, model_name=MODEL_NAME, temperature=0.6)
+        self.llm = get_chat_model(MODEL_NAME, temperature=0.6)
     
     def get_topic_suggestions(self, num_suggestions: int = 5) -> List[str]:
         """Get suggested questions based on syllabus topics"""
@@ -268,10 +270,16 @@ etc."""
 
 
 class DocumentManager:
-    """Manage multiple documents and their metadata"""
+    """Manage multiple documents, their metadata and their vectors in a namespace index"""
     
-    def __init__(self):
-        self.docs_file = "documents_metadata.json"
+    def __init__(self, namespace=None):
+        self.namespace = namespace
+        if namespace:
+            self.registry = get_index_registry()
+            self.docs_file = self.registry.path(namespace) + ".documents.json"
+        else:
+            self.registry = None
+            self.docs_file = "documents_metadata.json"
         self.documents = self._load_documents()
     
     def _load_documents(self) -> List[Dict]:
@@ -287,15 +295,16 @@ class DocumentManager:
     def save_documents(self):
         """Save document metadata"""
         try:
+            os.makedirs(os.path.dirname(self.docs_file) or ".", exist_ok=True)
             with open(self.docs_file, 'w') as f:
                 json.dump(self.documents, f, indent=2)
         except Exception as e:
             st.error(f"Error saving documents: {e}")
     
-    def add_document(self, name: str, pages: int, size: int, content_preview: str = ""):
-        """Add a new document"""
+    def add_document(self, name: str, pages: int, size: int, content_preview: str = "", index_id: str = None):
+        """Record a document; index_id is its key in the namespace index once ingested"""
         doc = {
-            "id": len(self.documents) + 1,
+            "id": max((d.get("id", 0) for d in self.documents), default=0) + 1,
             "name": name,
             "pages": pages,
             "size": size,
@@ -303,14 +312,25 @@ class DocumentManager:
             "content_preview": content_preview[:200],
             "questions_asked": 0
         }
+        if index_id:
+            doc["index_id"] = index_id
         self.documents.append(doc)
         self.save_documents()
         return doc
     
     def remove_document(self, doc_id: int):
-        """Remove a document"""
+        """Remove a document and, if no other entry shares its content, queue removal of its vectors.
+
+        The vectors are removed in the background from a private copy of the
+        index, which is swapped in once saved; returns that job, if any.
+        """
+        doc = self.get_document(doc_id)
         self.documents = [d for d in self.documents if d.get("id") != doc_id]
         self.save_documents()
+        index_id = doc.get("index_id") if doc else None
+        if index_id and self.registry and not any(d.get("index_id") == index_id for d in self.documents):
+            return get_ingest_queue().submit_removal(self.registry, self.namespace, index_id, doc.get("name", ""))
+        return None
     
     def get_document(self, doc_id: int) -> Dict:
         """Get document by ID"""
@@ -0,0 +1,94 @@
+"""
+Semantic answer cache for repeated exam questions.
+Answers are grouped by (index fingerprint, detected marks); within a group a
+new question reuses a stored answer when its embedding is close enough to a
+previously answered one. Entries expire after a TTL and each group keeps only
+its most recently used answers.
+"""
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+import streamlit as st
+
+SIMILARITY_THRESHOLD = 0.92   # cosine similarity on normalized MiniLM vectors
+TTL_SECONDS = 24 * 3600
+MAX_ENTRIES_PER_GROUP = 500
+MAX_GROUPS = 200
+
+
+class SemanticAnswerCache:
+    """Thread-safe nearest-question lookup over per-index answer groups."""
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD, ttl: float = TTL_SECONDS,
+                 max_entries: int = MAX_ENTRIES_PER_GROUP, max_groups: int = MAX_GROUPS):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_groups = max_groups
+        self._groups: "OrderedDict[tuple, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _prune(self, group: dict, now: float):
+        """Drop expired answers, then the least recently used ones past the cap."""
+        keep = [i for i, e in enumerate(group["entries"]) if now - e["created"] < self.ttl]
+        if len(keep) > self.max_entries:
+            keep.sort(key=lambda i: group["entries"][i]["last_used"])
+            keep = sorted(keep[-self.max_entries:])
+        if len(keep) != len(group["entries"]):
+            group["entries"] = [group["entries"][i] for i in keep]
+            group["vectors"] = group["vectors"][keep]
+
+    def lookup(self, index_id: str, marks: Optional[int], vector) -> Optional[str]:
+        """Stored answer for the most similar earlier question, if similar enough."""
+        now = time.time()
+        q = np.asarray(vector, dtype="float32")
+        with self._lock:
+            group = self._groups.get((index_id, marks))
+            if group is not None:
+                self._prune(group, now)
+            if group is None or not group["entries"]:
+                self.misses += 1
+                return None
+            self._groups.move_to_end((index_id, marks))
+            sims = group["vectors"] @ q
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                self.misses += 1
+                return None
+            entry = group["entries"][best]
+            entry["last_used"] = now
+            self.hits += 1
+            return entry["answer"]
+
+    def store(self, index_id: str, marks: Optional[int], question: str, vector, answer: str):
+        now = time.time()
+        q = np.asarray(vector, dtype="float32").reshape(1, -1)
+        with self._lock:
+            key = (index_id, marks)
+            group = self._groups.get(key)
+            if group is None:
+                group = {"vectors": np.empty((0, q.shape[1]), dtype="float32"), "entries": []}
+                self._groups[key] = group
+            group["vectors"] = np.vstack([group["vectors"], q])
+            group["entries"].append({"question": question, "answer": answer,
+                                     "created": now, "last_used": now})
+            self._prune(group, now)
+            self._groups.move_to_end(key)
+            while len(self._groups) > self.max_groups:
+                self._groups.popitem(last=False)
+
+    def invalidate(self, index_id: str):
+        """Forget every answer produced against an index that has since changed."""
+        with self._lock:
+            for key in [k for k in self._groups if k[0] == index_id]:
+                del self._groups[key]
+
+
+@st.cache_resource(show_spinner=False)
+def get_answer_cache() -> SemanticAnswerCache:
+    """Process-wide cache shared by every session."""
+    return SemanticAnswerCache()
@@ -1,21 +1,24 @@
 """
 Exam Assistant AI — Streamlit + Firebase Auth + Firestore chat history
 """
-import io, os, re, time
+import re, time
+from datetime import datetime
 import streamlit as st
-from PyPDF2 import PdfReader
-from vectorstore_utils import create_vectorstore, load_vectorstore
-from rag_chain import get_rag_chain, get_groq_api_key
-from langchain_groq import ChatGroq
+from vectorstore_utils import get_embeddings, index_fingerprint
+from ingest_jobs import submit_upload, render_jobs, get_ingest_queue
+from answer_cache import get_answer_cache
+from index_registry import get_index_registry, get_default_vectorstore
+from rag_chain import stream_rag_answer, stream_with_timing, get_chat_model, retrieval_query
 from firebase_auth import (
     init_auth_state, restore_session, logout,
     sign_up, sign_in, flush_user_profile,
-    create_chat_session, save_message, load_messages, get_user_sessions,
+    create_chat_session, get_user_sessions, run_concurrently, prefetch_messages,
 )
+from message_writer import get_message_writer, load_session_messages
 
-VECTORSTORE_DIR = "vectorstore"
 DATA_FILE       = "syllabus.txt"
 MODEL_NAME      = "llama-3.1-8b-instant"
+SIDEBAR_SESSIONS = 5   # previous chats listed in the sidebar, prefetched together
 
 # ── Page config ───────────────────────────────────────────────────────────────
 st.set_page_config(
@@ -143,7 +146,9 @@ def render_login():
                         st.session_state.user_name     = u.get("displayName") or u.get("email", "User")
                         st.session_state.id_token      = u["idToken"]
                         st.session_state.refresh_token = u["refreshToken"]
-                        flush_user_profile(u["localId"], u["idToken"])
+                        # Profile write and the chat list the next page needs, in one round-trip's time
+                        run_concurrently((flush_user_profile, u["localId"], u["idToken"]),
+                                         (get_user_sessions, u["localId"], u["idToken"]))
                         st.toast("✅ Logged in!")
                         st.rerun()
                     else:
@@ -213,8 +218,10 @@ def init_chat_state():
         "prefill":        None,
         "uploads":        [],
         "greeted":        False,
-        "indexed_files":  set(),
-        "vectorstore":    None,
+        "handled_uploads": set(),
+        "uploader_gen":   0,
+        "ingest_jobs":    {},
+        "removing":       {},
     }
     for k, v in defaults.items():
         if k not in st.session_state:
@@ -228,8 +235,10 @@ def init_chat_state():
             sessions = []
         if sessions:
             sid = sessions[0]["sessionId"]
+            # The latest chat and the ones listed in the sidebar, fetched together
+            prefetch_messages([s["sessionId"] for s in sessions[:SIDEBAR_SESSIONS]], tok)
             try:
-                stored = load_messages(sid, tok)
+                stored = load_session_messages(sid, tok)
                 st.session_state.messages = [{"role": m["role"], "content": m["content"]} for m in stored]
                 st.session_state.greeted  = True
             except Exception:
@@ -241,20 +250,29 @@ def init_chat_state():
                 sid = None
         st.session_state.session_id = sid
 
-    if st.session_state.vectorstore is None:
-        vs = None
-        try:
-            if os.path.exists(VECTORSTORE_DIR):
-                vs = load_vectorstore()
-        except Exception:
-            vs = None
-        if vs is None and os.path.exists(DATA_FILE):
-            try:
-                with open(DATA_FILE, "r", encoding="utf-8") as f:
-                    vs = create_vectorstore(f.read())
-            except Exception:
-                vs = None
-        st.session_state.vectorstore = vs
+
+def index_namespace():
+    """Registry namespace for the documents attached to the signed-in user's current chat."""
+    return ("users", st.session_state.user_id, st.session_state.get("session_id") or "unsaved")
+
+
+def reset_attachments():
+    """Forget this page's upload list when switching chats; the chat's own index stays.
+
+    The uploader gets a new key, so the file left in it is not attached to the next chat.
+    """
+    st.session_state.uploads         = []
+    st.session_state.handled_uploads = set()
+    st.session_state.uploader_gen   += 1
+
+
+def current_vectorstore():
+    """User's own index if they uploaded one, else the shared syllabus index."""
+    try:
+        vs = get_index_registry().get(index_namespace())
+        return vs if vs is not None else get_default_vectorstore(DATA_FILE)
+    except Exception:
+        return None
 
 
 init_chat_state()
@@ -282,6 +300,7 @@ with st.sidebar:
         st.session_state.messages       = []
         st.session_state.question_count = 0
         st.session_state.greeted        = False
+        reset_attachments()
         st.rerun()
     if st.button("🗑️ Clear Chat", use_container_width=True, key="btn_clear"):
         st.session_state.messages       = []
@@ -291,32 +310,53 @@ with st.sidebar:
 
     st.markdown('<div class="sidebar-title">📊 Session Status</div>', unsafe_allow_html=True)
     st.markdown(f'<div class="stat">Questions asked: {st.session_state.question_count}</div>', unsafe_allow_html=True)
+    if st.session_state.get("last_latency"):
+        lat = st.session_state.last_latency
+        st.markdown(f'<div class="stat">Last answer: first token {lat["ttft"]:.1f}s • total {lat["total"]:.1f}s</div>',
+                    unsafe_allow_html=True)
+
+    # Documents answers in this chat are grounded in, including ones uploaded in earlier logins
+    try:
+        chat_docs = get_index_registry().documents(index_namespace())
+    except Exception:
+        chat_docs = []
+    # Removals run in the background; hide their documents until the new index is in place
+    removing = st.session_state.removing
+    for doc_id in list(removing):
+        job = get_ingest_queue().get(removing[doc_id])
+        if job is None or not job.active:
+            del removing[doc_id]
+    chat_docs = [d for d in chat_docs if d["doc_id"] not in removing]
+    if chat_docs:
+        st.markdown('<div class="sidebar-title">📎 Documents in this chat</div>', unsafe_allow_html=True)
+        for d in chat_docs:
+            col_name, col_del = st.columns([5, 1])
+            col_name.caption(f"📄 {d['source']}")
+            if col_del.button("🗑️", key=f"rm_{d['doc_id']}", help="Remove from this chat"):
+                job = get_ingest_queue().submit_removal(get_index_registry(), index_namespace(), d["doc_id"], d["source"])
+                removing[d["doc_id"]] = job.id
+                st.session_state.uploads = [u for u in st.session_state.uploads if u["name"] != d["source"]]
+                st.rerun()
 
     st.markdown('<div class="sidebar-title">🗂️ Previous Chats</div>', unsafe_allow_html=True)
     try:
         sessions = get_user_sessions(st.session_state.user_id, st.session_state.id_token)
-        for s in sessions[:5]:
+        for s in sessions[:SIDEBAR_SESSIONS]:
             label     = s.get("createdAt", "Session")[:10]
             sid       = s["sessionId"]
             is_active = sid == st.session_state.session_id
             if st.button(f"{'▶ ' if is_active else ''}{label}", key=f"sess_{sid}", use_container_width=True):
-                msgs = load_messages(sid, st.session_state.id_token)
+                msgs = load_session_messages(sid, st.session_state.id_token)
                 st.session_state.messages       = [{"role": m["role"], "content": m["content"]} for m in msgs]
                 st.session_state.session_id     = sid
                 st.session_state.greeted        = True
                 st.session_state.question_count = sum(1 for m in msgs if m["role"] == "user")
+                reset_attachments()
                 st.rerun()
     except Exception:
         st.caption("Could not load previous chats.")
 
 # ── Helpers ───────────────────────────────────────────────────────────────────
-def parse_pdf_info(file):
-    data   = file.read()
-    reader = PdfReader(io.BytesIO(data))
-    pages  = len(reader.pages)
-    text   = "".join((p.extract_text() or "") + "\n" for p in reader.pages)
-    return text.strip(), pages
-
 def detect_marks(q):
     for pat in [r"(\b1\b|\b2\b|\b10\b|\b12\b)\s*mark",
                 r"(\b10\b|\b12\b)\s*marks",
@@ -346,21 +386,68 @@ def smalltalk_reply(text):
         return "You're welcome! Want to practice more questions?"
     return None
 
-def chat_llm(text):
+def chat_llm_stream(text, metrics=None):
+    llm = get_chat_model(MODEL_NAME, temperature=0.5)
+    return stream_with_timing(llm.stream(format_question(text)), metrics)
+
+def bot_html(content: str) -> str:
+    return (f'<div class="msg bot-msg"><div class="role"><span class="avatar">🤖</span>Assistant</div>'
+            f'{content}</div>')
+
+def render_stream(make_stream):
+    """Show tokens in the assistant bubble as they arrive; returns the full answer."""
+    placeholder = st.empty()
+    ans = ""
     try:
-        llm  = ChatGroq(groq_api_key=get_groq_api_key(), model_name=MODEL_NAME, temperature=0.5)
-        resp = llm.invoke(format_question(text))
-        return getattr(resp, "content", str(resp))
+        for piece in make_stream():
+            ans += piece
+            placeholder.markdown(bot_html(ans + "▌"), unsafe_allow_html=True)
     except Exception as e:
-        return f"Error generating answer: {str(e)}"
-
-def persist_msg(role: str, content: str):
+        ans += ("\n\n" if ans else "") + f"Error generating answer: {str(e)}"
+    placeholder.markdown(bot_html(ans), unsafe_allow_html=True)
+    return ans
+
+def answer_from_index(p: str, vectorstore, metrics: dict) -> str:
+    """RAG answer, reused from the semantic cache when a near-identical question was answered."""
+    cache = get_answer_cache()
+    marks = detect_marks(p)
+    try:
+        index_id = index_fingerprint(vectorstore)
+        # Same text the retriever embeds, so the question is encoded once
+        qvec     = get_embeddings().embed_query(retrieval_query(format_question(p)))
+    except Exception:
+        index_id = qvec = None
+
+    if qvec is not None:
+        hit = cache.lookup(index_id, marks, qvec)
+        if hit:
+            st.markdown(bot_html(hit), unsafe_allow_html=True)
+            return hit
+
+    with st.spinner("Thinking…"):
+        ans = render_stream(lambda: stream_rag_answer(vectorstore, format_question(p), metrics, marks))
+    # Only completed streams carry a total; failed answers are never cached
+    if qvec is not None and "total" in metrics:
+        cache.store(index_id, marks, p, qvec, ans)
+    return ans
+
+def utc_now() -> str:
+    return datetime.utcnow().isoformat() + "Z"
+
+def persist_msgs(*msgs):
+    """Queue (role, content, timestamp) messages for a batched background save."""
     try:
-        if st.session_state.get("session_id") and st.session_state.get("id_token"):
-            save_message(st.session_state.session_id, role, content, st.session_state.id_token)
+        sid, tok = st.session_state.get("session_id"), st.session_state.get("id_token")
+        if sid and tok:
+            writer = get_message_writer()
+            for role, content, ts in msgs:
+                writer.enqueue(sid, role, content, tok, ts, uid=st.session_state.user_id)
     except Exception:
         pass
 
+def persist_msg(role: str, content: str):
+    persist_msgs((role, content, utc_now()))
+
 # ── Main chat UI ──────────────────────────────────────────────────────────────
 st.markdown('<div class="page-title">🎓 Exam Assistant AI</div>', unsafe_allow_html=True)
 st.caption("Chat with your syllabus using RAG and get mark-based answers")
@@ -387,15 +474,25 @@ with container:
         st.session_state.greeted = True
         persist_msg("assistant", greeting)
 
-    # PDF upload
-    up_inline = st.file_uploader("📎 Attach syllabus PDF", type=["pdf"], key="uploader")
-    if up_inline and up_inline.name not in st.session_state.indexed_files:
-        with st.spinner(f"Processing {up_inline.name}…"):
-            text, pages = parse_pdf_info(up_inline)
-            st.session_state.vectorstore = create_vectorstore(text)
-        st.session_state.uploads.append({"name": up_inline.name, "size": up_inline.size, "pages": pages})
-        st.session_state.indexed_files.add(up_inline.name)
-        st.toast(f"✅ Indexed {up_inline.name} ({pages} pages)")
+    # PDF upload: indexed in the background; chat keeps using the current index meanwhile
+    up_inline = st.file_uploader("📎 Attach syllabus PDF", type=["pdf"],
+                                 key=f"uploader_{st.session_state.uploader_gen}")
+    jobs = st.session_state.ingest_jobs
+    # Each uploaded file is submitted once; it stays in the uploader across reruns and removals
+    handled = st.session_state.handled_uploads
+    if up_inline and up_inline.file_id not in handled and up_inline.name not in jobs:
+        if submit_upload(get_index_registry(), index_namespace(), up_inline, jobs) is not None:
+            handled.add(up_inline.file_id)
+
+    def attach_upload(job):
+        if job.namespace != index_namespace():
+            # Finished after the user switched chats: it belongs to the chat it was uploaded in
+            st.toast(f"✅ Indexed {job.name} into your previous chat")
+            return
+        st.session_state.uploads.append({"name": job.name, "size": job.size, "pages": job.pages_total})
+        st.toast(f"✅ Indexed {job.name} ({job.pages_total} pages)")
+
+    render_jobs(jobs, attach_upload, current=up_inline.name if up_inline else None)
 
     # Render messages
     for msg in st.session_state.messages:
@@ -413,32 +510,30 @@ with container:
 def process_prompt(p: str):
     st.session_state.messages.append({"role": "user", "content": p})
     st.session_state.question_count += 1
-    persist_msg("user", p)
+    asked_at = utc_now()
 
     st.markdown('<div class="chat-container">', unsafe_allow_html=True)
     st.markdown(
         f'<div class="msg user-msg"><div class="role"><span class="avatar">🧑‍🎓</span>User</div>{p}</div>',
         unsafe_allow_html=True)
 
-    if is_smalltalk(p):
-        ans = smalltalk_reply(p) or chat_llm(p)
-    elif not st.session_state.vectorstore:
+    vectorstore = current_vectorstore()
+    metrics = {}
+    reply = smalltalk_reply(p) if is_smalltalk(p) else None
+    if reply:
+        ans = reply
+        st.markdown(bot_html(ans), unsafe_allow_html=True)
+    elif is_smalltalk(p) or not vectorstore:
         with st.spinner("Thinking…"):
-            ans = chat_llm(p)
+            ans = render_stream(lambda: chat_llm_stream(p, metrics))
     else:
-        with st.spinner("Thinking…"):
-            try:
-                chain = get_rag_chain(st.session_state.vectorstore)
-                ans   = chain.invoke(format_question(p))
-            except Exception as e:
-                ans = f"Error: {str(e)}"
+        ans = answer_from_index(p, vectorstore, metrics)
+    if "total" in metrics:
+        st.session_state.last_latency = metrics
 
+    # Persist only the finished answer; both saves are queued together in order
     st.session_state.messages.append({"role": "assistant", "content": ans})
-    persist_msg("assistant", ans)
-
-    st.markdown(
-        f'<div class="msg bot-msg"><div class="role"><span class="avatar">🤖</span>Assistant</div>{ans}</div>',
-        unsafe_allow_html=True)
+    persist_msgs(("user", p, asked_at), ("assistant", ans, utc_now()))
     st.markdown('</div>', unsafe_allow_html=True)
 
 
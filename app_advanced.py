@@ -1,17 +1,17 @@
-import io
-import os
 import re
 import time
 import json
 import random
+import uuid
 from datetime import datetime
 import streamlit as st
-from PyPDF2 import PdfReader
-from config import DATA_FILE, VECTORSTORE_DIR
-from vectorstore_utils import create_vectorstore, load_vectorstore
-from rag_chain import get_rag_chain
-from langchain_groq import ChatGroq
-from config import GROQ_API_KEY, MODEL_NAME
+from config import DATA_FILE
+from advanced_features import DocumentManager
+from index_registry import get_index_registry, get_default_vectorstore
+from ingest_jobs import submit_upload, render_jobs
+from rag_chain import stream_rag_answer, stream_with_timing, get_chat_model
+from retrieval import document_units
+from config import MODEL_NAME
 
 # Page config
 st.set_page_config(
@@ -211,8 +211,9 @@ def init_session_state():
         "question_count": 0,
         "uploads": [],
         "greeted": False,
-        "indexed_files": set(),
-        "vectorstore": None,
+        "handled_uploads": set(),
+        "ingest_jobs": {},
+        "index_session": str(uuid.uuid4()),
         "bookmarks": [],
         "quiz_mode": False,
         "quiz_questions": [],
@@ -226,34 +227,25 @@ def init_session_state():
     for key, value in defaults.items():
         if key not in st.session_state:
             st.session_state[key] = value
-    
-    # Load vectorstore
-    if st.session_state.vectorstore is None:
-        vs = None
-        try:
-            if os.path.exists(VECTORSTORE_DIR):
-                vs = load_vectorstore()
-        except Exception:
-            vs = None
-        if vs is None and os.path.exists(DATA_FILE):
-            with open(DATA_FILE, "r", encoding="utf-8") as f:
-                base_text = f.read()
-            vs = create_vectorstore(base_text)
-        st.session_state.vectorstore = vs
+
+def index_namespace():
+    """Registry namespace for this browser session's uploaded documents"""
+    return ("sessions", st.session_state.index_session)
+
+def current_vectorstore():
+    """Session's own index if a PDF was uploaded, else the shared syllabus index"""
+    vs = get_index_registry().get(index_namespace())
+    return vs if vs is not None else get_default_vectorstore(DATA_FILE)
+
+def get_document_manager():
+    """Per-session document manager backed by the session's namespace index"""
+    if "doc_manager" not in st.session_state:
+        st.session_state.doc_manager = DocumentManager(namespace=index_namespace())
+    return st.session_state.doc_manager
 
 init_session_state()
 
 # Utility functions
-def parse_pdf_info(file):
-    data = file.read()
-    reader = PdfReader(io.BytesIO(data))
-    pages = len(reader.pages)
-    text = ""
-    for page in reader.pages:
-        t = page.extract_text() or ""
-        text += t + "\n"
-    return text.strip(), pages
-
 def detect_marks(q):
     ql = q.lower()
     patterns = [
@@ -282,7 +274,7 @@ def format_question(q):
 
 def generate_quiz_questions(vectorstore, num_questions=5):
     """Generate quiz questions from the syllabus"""
-    llm = ChatGroq(groq_api_key=GROQ_API_KEY, model_name=MODEL_NAME, temperature=0.7)
+    llm = get_chat_model(MODEL_NAME, temperature=0.7)
     
     prompt = f"""Based on the syllabus content, generate {num_questions} multiple-choice questions.
     Format each question as:
@@ -334,7 +326,7 @@ def export_chat_history(format_type="txt"):
 
 def suggest_questions(vectorstore):
     """Generate suggested questions based on syllabus"""
-    llm = ChatGroq(groq_api_key=GROQ_API_KEY, model_name=MODEL_NAME, temperature=0.6)
+    llm = get_chat_model(MODEL_NAME, temperature=0.6)
     
     prompt = """Based on the syllabus, suggest 5 important exam questions that students should practice.
     List them as:
@@ -393,9 +385,10 @@ with st.sidebar:
         )
     
     if st.button("🔄 Generate Suggestions"):
-        if st.session_state.vectorstore:
+        vectorstore = current_vectorstore()
+        if vectorstore:
             with st.spinner("Generating..."):
-                st.session_state.suggested_questions = suggest_questions(st.session_state.vectorstore)
+                st.session_state.suggested_questions = suggest_questions(vectorstore)
             st.success("✅ Suggestions ready!")
 
 # Main content
@@ -406,18 +399,50 @@ if mode == "💬 Chat Mode":
     # File uploader
     uploaded_file = st.file_uploader("📄 Upload Syllabus PDF", type=["pdf"])
     
-    if uploaded_file and uploaded_file.name not in st.session_state.indexed_files:
-        with st.spinner("🔄 Processing PDF..."):
-            text, pages = parse_pdf_info(uploaded_file)
-            st.session_state.vectorstore = create_vectorstore(text)
-            st.session_state.uploads.append({
-                "name": uploaded_file.name,
-                "size": uploaded_file.size,
-                "pages": pages,
-                "uploaded_at": datetime.now().strftime("%Y-%m-%d %H:%M")
-            })
-            st.session_state.indexed_files.add(uploaded_file.name)
-            st.success(f"✅ Indexed {uploaded_file.name} ({pages} pages)")
+    # Indexed in the background; chat keeps using the current index meanwhile
+    jobs = st.session_state.ingest_jobs
+    # Each uploaded file is submitted once; it stays in the uploader across reruns and deletes
+    handled = st.session_state.handled_uploads
+    if uploaded_file and uploaded_file.file_id not in handled and uploaded_file.name not in jobs:
+        if submit_upload(get_index_registry(), index_namespace(), uploaded_file, jobs) is not None:
+            handled.add(uploaded_file.file_id)
+    
+    def attach_upload(job):
+        doc = get_document_manager().add_document(
+            job.name, job.pages_total, job.size,
+            content_preview=job.preview, index_id=job.doc_id
+        )
+        st.session_state.uploads.append({
+            "name": job.name,
+            "size": job.size,
+            "pages": job.pages_total,
+            "uploaded_at": datetime.now().strftime("%Y-%m-%d %H:%M"),
+            "doc_id": doc["id"] if doc else None
+        })
+        st.toast(f"✅ Indexed {job.name} ({job.pages_total} pages)")
+    
+    render_jobs(jobs, attach_upload, current=uploaded_file.name if uploaded_file else None)
+    
+    # Search scope: restrict retrieval to one document, unit or page range
+    scope_filters = None
+    indexed_docs = [d for d in get_document_manager().documents if d.get("index_id")]
+    if indexed_docs:
+        with st.expander("🎯 Search Scope"):
+            names = ["All documents"] + [d["name"] for d in indexed_docs]
+            choice = st.selectbox("Document", names, key="scope_doc")
+            if choice != "All documents":
+                doc = indexed_docs[names.index(choice) - 1]
+                scope_filters = {"doc_id": doc["index_id"]}
+                vectorstore = current_vectorstore()
+                units = document_units(vectorstore, doc["index_id"]) if vectorstore else []
+                if units:
+                    unit = st.selectbox("Unit", ["All units"] + units, key="scope_unit")
+                    if unit != "All units":
+                        scope_filters["unit"] = unit
+                if doc.get("pages", 0) > 1:
+                    first, last = st.slider("Pages", 1, doc["pages"], (1, doc["pages"]), key="scope_pages")
+                    if (first, last) != (1, doc["pages"]):
+                        scope_filters["pages"] = (first, last)
     
     # Suggested questions
     if st.session_state.suggested_questions:
@@ -454,17 +479,30 @@ if mode == "💬 Chat Mode":
         st.session_state.messages.append({"role": "user", "content": prompt})
         st.session_state.question_count += 1
         
+        st.markdown(
+            f'<div class="msg user-msg"><strong>🧑‍🎓 User</strong><br>{prompt}</div>',
+            unsafe_allow_html=True
+        )
+        
+        # Stream the answer into place, then rerun to redraw the history
+        placeholder = st.empty()
+        answer = ""
         with st.spinner("🤔 Thinking..."):
-            if st.session_state.vectorstore:
-                chain = get_rag_chain(st.session_state.vectorstore)
-                q = format_question(prompt)
-                try:
-                    answer = chain.invoke(q)
-                except:
-                    answer = "Error generating answer."
-            else:
-                llm = ChatGroq(groq_api_key=GROQ_API_KEY, model_name=MODEL_NAME)
-                answer = llm.invoke(prompt).content
+            vectorstore = current_vectorstore()
+            try:
+                if vectorstore:
+                    pieces = stream_rag_answer(vectorstore, format_question(prompt), filters=scope_filters)
+                else:
+                    llm = get_chat_model(MODEL_NAME, temperature=0.7)
+                    pieces = stream_with_timing(llm.stream(prompt))
+                for piece in pieces:
+                    answer += piece
+                    placeholder.markdown(
+                        f'<div class="msg bot-msg"><strong>🤖 Assistant</strong><br>{answer}▌</div>',
+                        unsafe_allow_html=True
+                    )
+            except:
+                answer = answer or "Error generating answer."
             
             st.session_state.messages.append({"role": "assistant", "content": answer})
         st.rerun()
@@ -478,9 +516,10 @@ elif mode == "📝 Quiz Mode":
         num_questions = st.slider("Number of questions", 3, 10, 5)
     with col2:
         if st.button("🎲 Generate Quiz"):
-            if st.session_state.vectorstore:
+            vectorstore = current_vectorstore()
+            if vectorstore:
                 with st.spinner("Generating quiz..."):
-                    st.session_state.quiz_questions = generate_quiz_questions(st.session_state.vectorstore, num_questions)
+                    st.session_state.quiz_questions = generate_quiz_questions(vectorstore, num_questions)
                     st.session_state.quiz_mode = True
                     st.session_state.quiz_score = 0
                 st.success("Quiz ready!")
@@ -543,7 +582,11 @@ elif mode == "📚 Documents":
             with col2:
                 st.button("📖 View", key=f"view_{doc['name']}")
             with col3:
-                st.button("🗑️ Delete", key=f"del_{doc['name']}")
+                if st.button("🗑️ Delete", key=f"del_{doc['name']}"):
+                    if doc.get("doc_id") is not None:
+                        get_document_manager().remove_document(doc["doc_id"])
+                    st.session_state.uploads.remove(doc)
+                    st.rerun()
             st.markdown('</div>', unsafe_allow_html=True)
     else:
         st.info("No documents uploaded yet!")
@@ -1,9 +1,8 @@
-import io
 import os
 import re
-import time
 import streamlit as st
-from PyPDF2 import PdfReader
+from pdf_extract import extract_pdf_text, count_pages, MAX_PDF_PAGES
+from rag_chain import stream_with_timing
 import logging
 
 # Configure logging
@@ -221,19 +220,12 @@ def parse_pdf_info(file):
     """Parse PDF and extract text"""
     try:
         data = file.read()
-        reader = PdfReader(io.BytesIO(data))
-        pages = len(reader.pages)
+        total = count_pages(data)
         
-        if pages > 50:  # Limit for performance
-            st.warning(f"⚠️ Large PDF detected ({pages} pages). Processing first 50 pages only.")
-            pages = 50
+        if total > MAX_PDF_PAGES:  # Safety cap
+            st.warning(f"⚠️ Large PDF detected ({total} pages). Processing first {MAX_PDF_PAGES} pages only.")
             
-        text = ""
-        for i, page in enumerate(reader.pages[:pages]):
-            page_text = page.extract_text() or ""
-            text += page_text + "\n"
-            
-        return text.strip(), pages
+        return extract_pdf_text(data, MAX_PDF_PAGES)
     except Exception as e:
         st.error(f"Error processing PDF: {str(e)}")
         return "", 0
@@ -287,15 +279,14 @@ def get_llm():
         st.stop()
 
 def chat_llm(text):
-    """Generate response using LLM"""
+    """Generate response using LLM, yielding tokens as they stream"""
     try:
         llm = get_llm()
         q = format_question(text)
-        resp = llm.invoke(q)
-        return getattr(resp, "content", str(resp))
+        yield from stream_with_timing(llm.stream(q))
     except Exception as e:
         logger.error(f"LLM error: {str(e)}")
-        return "I encountered an error. Please try again or rephrase your question."
+        yield "I encountered an error. Please try again or rephrase your question."
 
 def is_smalltalk(text):
     """Check if text is smalltalk"""
@@ -427,23 +418,32 @@ if prompt := st.chat_input("Ask any question about your syllabus..."):
         unsafe_allow_html=True
     )
     
-    # Generate response
+    # Generate response, streaming tokens into the assistant bubble
+    placeholder = st.empty()
     with st.spinner("🤔 Thinking..."):
         if is_smalltalk(prompt):
-            response = smalltalk_template(prompt)
+            pieces = [smalltalk_template(prompt)]
         else:
             # Enhanced prompt with PDF content if available
             if st.session_state.pdf_content:
                 enhanced_prompt = f"Based on the following syllabus content, please answer this question:\n\nSyllabus: {st.session_state.pdf_content[:2000]}...\n\nQuestion: {prompt}"
-                response = chat_llm(enhanced_prompt)
+                pieces = chat_llm(enhanced_prompt)
             else:
-                response = chat_llm(prompt)
+                pieces = chat_llm(prompt)
         
-        time.sleep(0.1)  # Small delay for better UX
+        response = ""
+        for piece in pieces:
+            response += piece
+            placeholder.markdown(
+                f'<div class="msg bot-msg">'
+                f'<div class="role"><span class="avatar">🤖</span>Assistant</div>'
+                f'{response}▌</div>',
+                unsafe_allow_html=True
+            )
     
-    # Add and display response
+    # Add and display the finished response
     st.session_state.messages.append({"role": "assistant", "content": response})
-    st.markdown(
+    placeholder.markdown(
         f'<div class="msg bot-msg">'
         f'<div class="role"><span class="avatar">🤖</span>Assistant</div>'
         f'{response}</div>',
@@ -1,10 +1,12 @@
-import io
 import os
 import re
-import time
+import uuid
 import streamlit as st
 import logging
-from PyPDF2 import PdfReader
+from pdf_extract import count_pages, MAX_PDF_PAGES
+from rag_chain import stream_with_timing, stream_rag_answer
+from index_registry import get_index_registry
+from ingest_jobs import submit_upload, render_jobs
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -32,26 +34,14 @@ def get_groq_api_key():
         st.stop()
 
 # Utility functions
-def parse_pdf_info(file):
-    """Parse PDF and extract text"""
+def warn_if_truncated(uploaded_file):
+    """Warn when a PDF is longer than the pages that will be indexed"""
     try:
-        data = file.read()
-        reader = PdfReader(io.BytesIO(data))
-        pages = len(reader.pages)
-        
-        if pages > 50:  # Limit for performance
-            st.warning(f"⚠️ Large PDF detected ({pages} pages). Processing first 50 pages only.")
-            pages = 50
-            
-        text = ""
-        for i, page in enumerate(reader.pages[:pages]):
-            page_text = page.extract_text() or ""
-            text += page_text + "\n"
-            
-        return text.strip(), pages
-    except Exception as e:
-        st.error(f"Error processing PDF: {str(e)}")
-        return "", 0
+        total = count_pages(uploaded_file.getvalue())
+    except Exception:
+        return
+    if total > MAX_PDF_PAGES:  # Safety cap
+        st.warning(f"⚠️ Large PDF detected ({total} pages). Processing first {MAX_PDF_PAGES} pages only.")
 
 def detect_marks(q):
     """Detect marks from question"""
@@ -375,7 +365,8 @@ def initialize_session_state():
         "uploads": [],
         "greeted": False,
         "indexed_files": set(),
-        "pdf_content": "",
+        "ingest_jobs": {},
+        "index_session": str(uuid.uuid4()),
         "error_count": 0,
         "last_error": None
     }
@@ -384,39 +375,52 @@ def initialize_session_state():
         if key not in st.session_state:
             st.session_state[key] = default_value
 
-def process_chat_message(prompt):
-    """Process chat message with error handling"""
+def index_namespace():
+    """Registry namespace for this browser session's uploaded documents"""
+    return ("sessions", st.session_state.index_session)
+
+def current_vectorstore():
+    """Index of the PDFs uploaded in this session, or None before the first upload"""
+    try:
+        return get_index_registry().get(index_namespace())
+    except Exception as e:
+        logger.error(f"Error loading index: {str(e)}")
+        return None
+
+def process_chat_message(prompt, metrics=None):
+    """Process chat message with error handling, yielding the answer as it streams"""
     try:
         # Sanitize input
         prompt = sanitize_input(prompt)
         if not prompt:
-            return "Please enter a valid question."
+            yield "Please enter a valid question."
+            return
         
         # Handle smalltalk
         if is_smalltalk(prompt):
             response = get_smalltalk_response(prompt)
             if response:
-                return response
+                yield response
+                return
         
         # Format question for marks
         formatted_question = format_question(prompt)
         
-        # Enhanced prompt with PDF content if available
-        if st.session_state.pdf_content:
-            enhanced_prompt = f"Based on the following syllabus content, please answer this question:\n\nSyllabus: {st.session_state.pdf_content[:2000]}...\n\nQuestion: {formatted_question}"
-        else:
-            enhanced_prompt = formatted_question
+        # Answer from the pages relevant to the question once a PDF is indexed
+        vectorstore = current_vectorstore()
+        if vectorstore is not None:
+            yield from stream_rag_answer(vectorstore, formatted_question, metrics, detect_marks(prompt))
+            return
         
-        # Generate response using LLM
+        # Stream response tokens from the LLM
         llm = get_llm()
-        response = llm.invoke(enhanced_prompt)
-        return getattr(response, "content", str(response))
+        yield from stream_with_timing(llm.stream(formatted_question), metrics)
         
     except Exception as e:
         logger.error(f"Error processing message: {str(e)}")
         st.session_state.error_count += 1
         st.session_state.last_error = str(e)
-        return "I encountered an error processing your question. Please try again or rephrase your question."
+        yield "I encountered an error processing your question. Please try again or rephrase your question."
 
 def main():
     """Main application function"""
@@ -462,32 +466,24 @@ def main():
         help="Upload a PDF file (max 10MB) containing your syllabus or study material"
     )
     
-    # Process uploaded file
-    if uploaded_file and uploaded_file.name not in st.session_state.indexed_files:
-        if validate_file_upload(uploaded_file):
-            try:
-                with st.spinner("🔄 Processing PDF..."):
-                    text, pages = parse_pdf_info(uploaded_file)
-                    
-                    if text:
-                        # Store PDF content
-                        st.session_state.pdf_content = text
-                        
-                        # Update session state
-                        st.session_state.uploads.append({
-                            "name": uploaded_file.name,
-                            "size": uploaded_file.size,
-                            "pages": pages
-                        })
-                        st.session_state.indexed_files.add(uploaded_file.name)
-                        
-                        st.success(f"✅ Successfully processed {uploaded_file.name} ({pages} pages)")
-                    else:
-                        st.error("❌ Could not extract text from PDF")
-                    
-            except Exception as e:
-                st.error(f"❌ Error processing PDF: {str(e)}")
-                logger.error(f"PDF processing error: {str(e)}")
+    # Process uploaded file in the background; chat keeps using the current index meanwhile
+    jobs = st.session_state.ingest_jobs
+    if (uploaded_file and uploaded_file.name not in st.session_state.indexed_files
+            and uploaded_file.name not in jobs and validate_file_upload(uploaded_file)):
+        warn_if_truncated(uploaded_file)
+        submit_upload(get_index_registry(), index_namespace(), uploaded_file, jobs)
+    
+    def attach_upload(job):
+        """Record a finished upload; its index is already in this session's namespace"""
+        st.session_state.uploads.append({
+            "name": job.name,
+            "size": job.size,
+            "pages": job.pages_total
+        })
+        st.session_state.indexed_files.add(job.name)
+        st.toast(f"✅ Successfully processed {job.name} ({job.pages_total} pages)")
+    
+    render_jobs(jobs, attach_upload, current=uploaded_file.name if uploaded_file else None)
     
     # Chat interface
     container = st.container()
@@ -534,16 +530,24 @@ def main():
             unsafe_allow_html=True
         )
         
-        # Generate and display response
+        # Stream the response into the assistant bubble as tokens arrive
+        placeholder = st.empty()
+        response = ""
         with st.spinner("🤔 Thinking..."):
-            response = process_chat_message(prompt)
-            time.sleep(0.1)  # Small delay for better UX
+            for piece in process_chat_message(prompt):
+                response += piece
+                placeholder.markdown(
+                    f'<div class="msg bot-msg">'
+                    f'<div class="role"><span class="avatar">🤖</span>Assistant</div>'
+                    f'{response}▌</div>',
+                    unsafe_allow_html=True
+                )
         
-        # Add assistant response
+        # Add the finished assistant response
         st.session_state.messages.append({"role": "assistant", "content": response})
         
         # Display assistant response
-        st.markdown(
+        placeholder.markdown(
             f'<div class="msg bot-msg">'
             f'<div class="role"><span class="avatar">🤖</span>Assistant</div>'
             f'{response}</div>',
@@ -0,0 +1,52 @@
+"""
+Build or validate the default syllabus index before the server starts.
+
+Usage:
+    python build_index.py                  # build DATA_FILE's index if stale
+    python build_index.py notes.txt --check
+
+The index is rebuilt only when vectorstore/manifest.json does not match the
+file's hash, the embedding model or the splitter settings, so running this
+on every start is cheap. With --check nothing is built; the exit status says
+whether the index is current. A missing data file is not an error: the app
+then simply starts without a default index.
+
+Indexes saved by older versions (index.pkl) are converted first, see
+migrate_indexes.py; the app itself no longer loads them.
+"""
+import os
+import sys
+import argparse
+from config import DATA_FILE
+from index_registry import build_default_index, default_index_is_current, read_text, read_manifest
+from migrate_indexes import migrate
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data_file", nargs="?", default=DATA_FILE)
+    parser.add_argument("--check", action="store_true", help="only report whether the index is current")
+    args = parser.parse_args(argv)
+
+    # Uploads indexed by older versions would otherwise not load at all
+    migrated = migrate(dry_run=args.check) == 0
+    if not os.path.exists(args.data_file):
+        print(f"{args.data_file} not found; no default index to build")
+        return 0 if migrated else 1
+    if args.check:
+        current = default_index_is_current(args.data_file, read_text(args.data_file))
+        print(f"{args.data_file}: index {'current' if current else 'missing or stale'}")
+        return 0 if current else 1
+
+    vectorstore, rebuilt = build_default_index(args.data_file)
+    if vectorstore is None:
+        print(f"FAILED to build index for {args.data_file}")
+        return 1
+    manifest = read_manifest(args.data_file) or {}
+    state = f"built in {manifest.get('build_seconds')}s" if rebuilt else "up to date"
+    print(f"{args.data_file}: {vectorstore.index.ntotal} chunks, {state} (key {manifest.get('key')})")
+    return 0 if migrated else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Compare an embedding backend against the full-precision torch backend.
+
+Usage:
+    python check_embeddings.py onnx-int8
+    python check_embeddings.py onnx --corpus syllabus.txt
+
+Reports model load time, encode throughput, per-text cosine similarity to the
+torch vectors, and how often the top-5 neighbours agree. Exits non-zero when
+the candidate falls below the accuracy thresholds.
+"""
+import sys
+import time
+import argparse
+import numpy as np
+from vectorstore_utils import load_embedding_model, get_splitter, BACKEND_MODEL_KWARGS
+
+MIN_MEAN_COSINE = 0.98
+MIN_TOP5_OVERLAP = 0.90
+
+# Fixture corpus: short syllabus-style passages covering the usual subjects
+FIXTURE_CORPUS = [
+    "Normalization is the process of organizing data in a database to reduce redundancy.",
+    "First normal form requires that every column holds atomic values.",
+    "Second normal form removes partial dependencies on a composite primary key.",
+    "Third normal form removes transitive dependencies between non-key attributes.",
+    "A deadlock occurs when processes wait on each other's resources indefinitely.",
+    "The banker's algorithm avoids deadlock by checking for a safe state before allocation.",
+    "Paging divides memory into fixed-size frames and processes into pages.",
+    "A page fault occurs when a referenced page is not in main memory.",
+    "TCP provides reliable, ordered delivery using sequence numbers and acknowledgements.",
+    "UDP is a connectionless protocol with no delivery guarantees.",
+    "The OSI model has seven layers from physical to application.",
+    "Dijkstra's algorithm finds shortest paths from a source in graphs with non-negative weights.",
+    "Binary search runs in O(log n) time on a sorted array.",
+    "Quick sort has average complexity O(n log n) and worst case O(n^2).",
+    "A stack is a LIFO structure supporting push and pop operations.",
+    "A queue is a FIFO structure supporting enqueue and dequeue operations.",
+    "Ohm's law states that voltage equals current times resistance (V = IR).",
+    "Kirchhoff's current law says currents entering a node sum to zero.",
+    "Newton's second law relates force, mass and acceleration: F = ma.",
+    "The first law of thermodynamics is conservation of energy.",
+    "Photosynthesis converts light energy into chemical energy stored in glucose.",
+    "Mitosis produces two genetically identical daughter cells.",
+    "Supply and demand determine the equilibrium price in a competitive market.",
+    "Inflation is a sustained increase in the general price level.",
+    "UNIT II: Process scheduling - FCFS, SJF, priority and round robin.",
+    "CS3401 Algorithms: greedy method, dynamic programming, backtracking.",
+    "Explain the ACID properties of transactions (10 marks).",
+    "Define entropy (2 marks).",
+]
+
+
+def load_corpus(path):
+    if not path:
+        return FIXTURE_CORPUS
+    with open(path, "r", encoding="utf-8") as f:
+        return get_splitter().split_text(f.read())
+
+
+def encode(backend, texts):
+    start = time.perf_counter()
+    model = load_embedding_model(backend)
+    loaded = time.perf_counter()
+    vectors = np.asarray(model.embed_documents(texts), dtype="float32")
+    done = time.perf_counter()
+    return vectors, loaded - start, len(texts) / max(done - loaded, 1e-9)
+
+
+def top_k(vectors, k):
+    sims = vectors @ vectors.T
+    np.fill_diagonal(sims, -np.inf)
+    return np.argsort(-sims, axis=1)[:, :k]
+
+
+def compare(candidate, texts, k=5):
+    ref, ref_load, ref_rate = encode("torch", texts)
+    cand, cand_load, cand_rate = encode(candidate, texts)
+
+    cosines = np.sum(ref * cand, axis=1)   # both sides are L2-normalized
+    k = min(k, len(texts) - 1)
+    ref_nn, cand_nn = top_k(ref, k), top_k(cand, k)
+    overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(ref_nn, cand_nn)])
+
+    return {
+        "texts": len(texts),
+        "load_seconds": {"torch": round(ref_load, 2), candidate: round(cand_load, 2)},
+        "texts_per_sec": {"torch": round(ref_rate, 1), candidate: round(cand_rate, 1)},
+        "mean_cosine": float(np.mean(cosines)),
+        "min_cosine": float(np.min(cosines)),
+        f"top{k}_overlap": float(overlap),
+        "passed": bool(np.mean(cosines) >= MIN_MEAN_COSINE and overlap >= MIN_TOP5_OVERLAP),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("backend", choices=[b for b in BACKEND_MODEL_KWARGS if b != "torch"])
+    parser.add_argument("--corpus", help="text file to chunk and use instead of the fixture corpus")
+    args = parser.parse_args(argv)
+
+    report = compare(args.backend, load_corpus(args.corpus))
+    for key, value in report.items():
+        print(f"{key:>16}: {value}")
+    return 0 if report["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+"""
+Compare FAISS index types on a saved index's vectors.
+
+Usage:
+    python check_index.py vectorstore/namespaces/users/<uid>
+    python check_index.py vectorstore/docs/<key> --factory HNSW32 --factory "IVF256,PQ48"
+
+Builds each index type over the stored vectors and reports build time,
+recall@10 against exact search on held-out vectors, per-query latency and
+serialized size. Exits non-zero when the type "auto" would pick falls below
+MIN_RECALL.
+"""
+import os
+import sys
+import argparse
+import faiss
+from index_factory import choose_index_factory, index_vectors, recall_report, RECALL_K
+
+MIN_RECALL = 0.90
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="index directory containing index.faiss")
+    parser.add_argument("--factory", action="append", help="faiss index_factory string (repeatable)")
+    args = parser.parse_args(argv)
+
+    vectors = index_vectors(faiss.read_index(os.path.join(args.path, "index.faiss")))
+    chosen = choose_index_factory(len(vectors))
+    factories = args.factory or sorted({"Flat", "HNSW32", chosen})
+
+    passed = True
+    for factory in factories:
+        try:
+            report = recall_report(vectors, factory)
+        except RuntimeError as e:
+            print(f"{factory:>16}: failed ({e})")
+            continue
+        marker = "  <- auto" if factory == chosen else ""
+        print(f"{factory:>16}: " + ", ".join(f"{k}={v}" for k, v in report.items() if k != "factory") + marker)
+        if factory == chosen and report[f"recall@{RECALL_K}"] < MIN_RECALL:
+            passed = False
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
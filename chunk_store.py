@@ -0,0 +1,161 @@
+"""
+Append-only SQLite docstore for saved indexes.
+Chunk text and metadata live in "<index dir>.chunks.sqlite", beside the index
+directory, and are read by id only when a search returns them. Saving an
+index only inserts the chunks it added; rows are never rewritten in place,
+so readers holding an older id mapping keep working. Which chunks are live
+is decided by ids.json inside the index directory, which is swapped
+atomically together with index.faiss.
+"""
+import os
+import json
+import sqlite3
+import threading
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+from langchain_core.documents import Document
+from langchain_community.docstore.base import AddableMixin, Docstore
+
+CHUNKS_SUFFIX = ".chunks.sqlite"
+IDS_FILE = "ids.json"
+LEGACY_CHUNKS_FILE = "chunks.sqlite"   # earlier layout: inside the index dir, with positions
+COMPACT_MIN_ROWS = 1000                # rewrite a store once dead rows outnumber live ones
+
+
+def chunk_store_path(index_path: str) -> str:
+    """Chunk store file belonging to an index directory."""
+    return os.path.normpath(index_path) + CHUNKS_SUFFIX
+
+
+class ChunkStore(Docstore, AddableMixin):
+    """Read-only view of a chunk store with an in-memory overlay for adds and deletes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._added: Dict[str, Document] = {}
+        self._deleted: set = set()
+
+    def id_mapping(self) -> Dict[int, str]:
+        """FAISS position -> chunk id, for stores in the earlier layout that saved positions."""
+        with self._lock:
+            rows = self._conn.execute("SELECT pos, id FROM chunks ORDER BY pos").fetchall()
+        return {pos: cid for pos, cid in rows}
+
+    def search(self, search: str) -> Union[str, Document]:
+        if search in self._added:
+            return self._added[search]
+        if search in self._deleted:
+            return f"ID {search} not found."
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, metadata FROM chunks WHERE id = ?", (search,)
+            ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        self._added.update(texts)
+        self._deleted.difference_update(texts)
+
+    def delete(self, ids: List) -> None:
+        for cid in ids:
+            self._added.pop(cid, None)
+            self._deleted.add(cid)
+
+    def persisted(self, ids: Iterable[str]):
+        """Forget overlay entries that are now stored, reopening in case the file was compacted."""
+        with self._lock:
+            self._conn.close()
+            self._conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        for cid in ids:
+            self._added.pop(cid, None)
+
+    def iter_metadata(self) -> Iterator[Tuple[str, dict]]:
+        """(chunk id, metadata) for every stored and added chunk, in one pass over the table."""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, metadata FROM chunks").fetchall()
+        for cid, metadata in rows:
+            if cid not in self._deleted and cid not in self._added:
+                yield cid, json.loads(metadata)
+        for cid, doc in self._added.items():
+            yield cid, doc.metadata
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    # Rollback journal, not WAL: compaction swaps the file, which a shared WAL would not survive
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, "
+                 "text TEXT NOT NULL, metadata TEXT NOT NULL)")
+    return conn
+
+
+def append_chunks(path: str, vectorstore):
+    """Insert the vectorstore's chunks that the store at path does not hold yet."""
+    docstore = vectorstore.docstore
+    live = list(vectorstore.index_to_docstore_id.values())
+    own = isinstance(docstore, ChunkStore) and os.path.abspath(docstore.path) == os.path.abspath(path)
+    conn = _connect(path)
+    try:
+        if own:
+            # Loaded from this store: only the overlay is new
+            pending = [cid for cid in live if cid in docstore._added]
+        else:
+            stored = {row[0] for row in conn.execute("SELECT id FROM chunks")}
+            pending = [cid for cid in live if cid not in stored]
+        rows = []
+        for cid in pending:
+            doc = docstore.search(cid)
+            rows.append((cid, doc.page_content, json.dumps(doc.metadata)))
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO chunks (id, text, metadata) VALUES (?, ?, ?)", rows)
+    finally:
+        conn.close()
+    if own:
+        docstore.persisted(pending)
+
+
+def compact_chunks(path: str, live: Iterable[str]):
+    """Once dead rows outnumber live ones, copy the live rows into a fresh file and swap it in.
+
+    Call only after the index that uses exactly these ids is in place;
+    readers that opened the old file keep reading it.
+    """
+    live = set(live)
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        total = conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+    finally:
+        conn.close()
+    if total <= max(COMPACT_MIN_ROWS, 2 * len(live)):
+        return
+    tmp = path + ".compact"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    src = sqlite3.connect(path, timeout=30)
+    dst = _connect(tmp)
+    try:
+        rows = (row for row in src.execute("SELECT id, text, metadata FROM chunks") if row[0] in live)
+        with dst:
+            dst.executemany("INSERT INTO chunks (id, text, metadata) VALUES (?, ?, ?)", rows)
+    finally:
+        src.close()
+        dst.close()
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        # Windows refuses to replace a file that is open; compact on a later save
+        os.remove(tmp)
+
+
+def write_ids(path: str, vectorstore):
+    """Write the position-ordered chunk ids of a vectorstore into an index directory."""
+    mapping = vectorstore.index_to_docstore_id
+    with open(os.path.join(path, IDS_FILE), "w", encoding="utf-8") as f:
+        json.dump([mapping[p] for p in range(len(mapping))], f, separators=(",", ":"))
+
+
+def read_ids(path: str) -> Dict[int, str]:
+    with open(os.path.join(path, IDS_FILE), "r", encoding="utf-8") as f:
+        return dict(enumerate(json.load(f)))
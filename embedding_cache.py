@@ -0,0 +1,149 @@
+"""
+Persistent chunk-level embedding cache shared by every index build.
+Vectors are keyed by (embedding model, normalized chunk text) and kept in
+a small SQLite file with least-recently-used eviction. Query vectors never
+reach the file; a small in-memory LRU lets one question be encoded once
+even when several components embed it.
+"""
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from typing import List
+from langchain_core.embeddings import Embeddings
+
+CACHE_PATH = os.path.join("vectorstore", "embedding_cache.sqlite")
+MAX_ENTRIES = 100_000   # ~150 MB of 384-dim float32 vectors
+EVICT_TO = 0.9          # evict down to this share of the cap so eviction runs rarely
+QUERY_CACHE_SIZE = 256
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so re-extracted PDFs map to the same key."""
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class EmbeddingCache:
+    """SQLite-backed vector store with LRU eviction, safe to share across threads."""
+
+    def __init__(self, path: str = CACHE_PATH, max_entries: int = MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        # Kept incrementally; recounted only when it crosses the cap (other processes share the file)
+        (self._count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        h = hashlib.sha256()
+        h.update(model.encode("utf-8"))
+        h.update(b"\0")
+        h.update(normalize_text(text).encode("utf-8"))
+        return h.hexdigest()
+
+    def get_many(self, keys: List[str]) -> dict:
+        """Return {key: vector} for the keys present, marking them as recently used."""
+        found = {}
+        if not keys:
+            return found
+        now = time.time()
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            for i in range(0, len(unique), 500):
+                part = unique[i:i + 500]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", part
+                ).fetchall()
+                for key, blob in rows:
+                    vec = array("f")
+                    vec.frombytes(blob)
+                    found[key] = vec.tolist()
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, k) for k in found],
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, items: dict):
+        """Store {key: vector} and evict the least recently used rows past the cap."""
+        if not items:
+            return
+        now = time.time()
+        rows = [(k, array("f", v).tobytes(), now) for k, v in items.items()]
+        with self._lock:
+            before = self._conn.total_changes
+            # Same key means same model and text, so an existing vector is already right
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                rows,
+            )
+            self._count += self._conn.total_changes - before
+            if self._count > self.max_entries:
+                (self._count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+                excess = self._count - int(self.max_entries * EVICT_TO)
+                if self._count > self.max_entries and excess > 0:
+                    cur = self._conn.execute(
+                        "DELETE FROM embeddings WHERE key IN ("
+                        " SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                        (excess,),
+                    )
+                    self._count -= cur.rowcount
+            self._conn.commit()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends uncached texts to the underlying model."""
+
+    def __init__(self, base: Embeddings, cache: EmbeddingCache, model: str):
+        self.base = base
+        self.cache = cache
+        self.model = model
+        self._queries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._queries_lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self.cache.make_key(self.model, t) for t in texts]
+        found = self.cache.get_many(keys)
+
+        # Encode each missing text once, even if it repeats within the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.base.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(fresh)
+            found.update(fresh)
+
+        return [found[k] for k in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        """Encode a question, bypassing the chunk cache; recent questions are kept in memory."""
+        key = normalize_text(text)
+        with self._queries_lock:
+            if key in self._queries:
+                self._queries.move_to_end(key)
+                return self._queries[key]
+        vector = self.base.embed_query(text)
+        with self._queries_lock:
+            self._queries[key] = vector
+            while len(self._queries) > QUERY_CACHE_SIZE:
+                self._queries.popitem(last=False)
+        return vector
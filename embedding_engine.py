@@ -0,0 +1,91 @@
+"""
+Batched embedding engine.
+Chunking runs in a producer thread while the calling thread encodes fixed-size
+batches, so PDF parsing/splitting overlaps with the CPU-bound encoder.
+"""
+import os
+import time
+import queue
+import logging
+import threading
+from typing import Callable, Iterable, List, Optional, Tuple
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", str(os.cpu_count() or 1)))
+QUEUE_BATCHES = 4   # batches chunked ahead of the encoder
+
+_DONE = object()
+
+
+def configure_torch_threads(threads: int = EMBED_THREADS):
+    """Pin torch intra-op threads; a no-op when torch is not the backend."""
+    try:
+        import torch
+        torch.set_num_threads(max(1, threads))
+    except ImportError:
+        pass
+
+
+class EmbeddingEngine:
+    """Encode a stream of chunk Documents in batches, overlapping chunking with encoding."""
+
+    def __init__(self, embeddings, batch_size: int = EMBED_BATCH_SIZE,
+                 progress: Optional[Callable[[int], None]] = None):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.progress = progress
+        self.stats = {"chunks": 0, "seconds": 0.0, "chunks_per_sec": 0.0}
+
+    def _produce(self, documents: Iterable[Document], out: queue.Queue, stop: threading.Event):
+        try:
+            batch = []
+            for doc in documents:
+                if stop.is_set():
+                    return
+                batch.append(doc)
+                if len(batch) >= self.batch_size:
+                    out.put(batch)
+                    batch = []
+            if batch:
+                out.put(batch)
+            out.put(_DONE)
+        except BaseException as e:
+            out.put(e)
+
+    def embed_stream(self, documents: Iterable[Document]) -> Tuple[List[Document], List[List[float]]]:
+        """Return the chunks and their vectors, in input order."""
+        start = time.perf_counter()
+        batches: queue.Queue = queue.Queue(maxsize=QUEUE_BATCHES)
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(documents, batches, stop), daemon=True)
+        producer.start()
+
+        docs, vectors = [], []
+        try:
+            while True:
+                item = batches.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                vectors.extend(self.embeddings.embed_documents([d.page_content for d in item]))
+                docs.extend(item)
+                if self.progress:
+                    self.progress(len(docs))
+        finally:
+            # Unblock the producer if encoding failed part-way
+            stop.set()
+            while producer.is_alive():
+                try:
+                    batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+        elapsed = time.perf_counter() - start
+        rate = len(docs) / elapsed if elapsed > 0 else 0.0
+        self.stats = {"chunks": len(docs), "seconds": round(elapsed, 3), "chunks_per_sec": round(rate, 1)}
+        logger.info(f"Embedded {len(docs)} chunks in {elapsed:.2f}s ({rate:.1f} chunks/sec)")
+        return docs, vectors
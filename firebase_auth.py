@@ -6,7 +6,46 @@ Handles sign-up, login, logout, session restore, and user-specific chat persiste
 import streamlit as st
 import requests
 import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# ---------------------------------------------------------------------------
+# Pooled HTTP client
+# ---------------------------------------------------------------------------
+
+_http_session = None
+_http_lock = threading.Lock()
+
+
+def _http() -> requests.Session:
+    """Process-wide keep-alive session shared by every Firebase call."""
+    global _http_session
+    with _http_lock:
+        if _http_session is None:
+            session = requests.Session()
+            # Auth calls (sign-up etc.) are not idempotent: only retry failed connects
+            session.mount("https://", HTTPAdapter(
+                pool_connections=4, pool_maxsize=32,
+                max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2),
+            ))
+            # Firestore writes use client-chosen document ids, so retrying them is safe
+            session.mount("https://firestore.googleapis.com/", HTTPAdapter(
+                pool_connections=4, pool_maxsize=32,
+                max_retries=Retry(
+                    total=3, backoff_factor=0.3,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=frozenset({"GET", "POST", "PATCH"}),
+                    raise_on_status=False,
+                ),
+            ))
+            _http_session = session
+        return _http_session
 
 
 # ---------------------------------------------------------------------------
@@ -45,7 +84,7 @@ def _auth_post(endpoint: str, payload: dict) -> dict:
     """POST to Firebase Auth REST API and return JSON response."""
     api_key = get_firebase_api_key()
     url = f"{AUTH_BASE}:{endpoint}?key={api_key}"
-    resp = requests.post(url, json=payload, timeout=10)
+    resp = _http().post(url, json=payload, timeout=10)
     return resp.json()
 
 
@@ -87,7 +126,7 @@ def refresh_token(refresh_tok: str) -> dict:
     """Exchange a refresh token for a new ID token."""
     api_key = get_firebase_api_key()
     url = f"https://securetoken.googleapis.com/v1/token?key={api_key}"
-    resp = requests.post(url, json={
+    resp = _http().post(url, json={
         "grant_type": "refresh_token",
         "refresh_token": refresh_tok,
     }, timeout=10)
@@ -198,19 +237,70 @@ def flush_user_profile(uid: str, id_token: str):
     profile = _pending_profiles.pop(uid)
     fields = {k: _to_fs_value(v) for k, v in profile.items()}
     url = _fs_url(f"users/{uid}")
-    requests.patch(url, headers=_fs_headers(id_token),
+    _http().patch(url, headers=_fs_headers(id_token),
                    json={"fields": fields}, timeout=10)
 
 
 def get_user_profile(uid: str, id_token: str) -> dict:
     """Fetch user profile from Firestore."""
     url = _fs_url(f"users/{uid}")
-    resp = requests.get(url, headers=_fs_headers(id_token), timeout=10)
+    resp = _http().get(url, headers=_fs_headers(id_token), timeout=10)
     if resp.status_code == 200:
         return _doc_to_dict(resp.json())
     return {}
 
 
+# ---------------------------------------------------------------------------
+# Read cache — session lists and message histories, shared across reruns
+# ---------------------------------------------------------------------------
+
+SESSIONS_TTL = 60     # seconds
+MESSAGES_TTL = 300
+
+# Entries are keyed by (kind, id, token digest) and only stored after Firestore
+# accepted that token for the read, so a cached result is only ever served to
+# a caller whose token was authorised for it.
+_read_cache: dict = {}
+_read_cache_lock = threading.Lock()
+
+
+def _cache_key(kind: str, ident: str, id_token: str) -> tuple:
+    return (kind, ident, hashlib.sha256((id_token or "").encode("utf-8")).hexdigest())
+
+
+def _cache_get(key):
+    with _read_cache_lock:
+        hit = _read_cache.get(key)
+        if hit and hit[0] > time.monotonic():
+            return list(hit[1])
+        _read_cache.pop(key, None)
+        return None
+
+
+def _cache_put(key, value: list, ttl: float):
+    with _read_cache_lock:
+        now = time.monotonic()
+        # Tokens rotate hourly; drop expired entries so old token keys do not pile up
+        for stale in [k for k, (expires, _) in _read_cache.items() if expires <= now]:
+            del _read_cache[stale]
+        _read_cache[key] = (now + ttl, list(value))
+
+
+def _cache_invalidate(kind: str, ident: str):
+    """Drop every caller's cached copy of one session list or history."""
+    with _read_cache_lock:
+        for key in [k for k in _read_cache if k[:2] == (kind, ident)]:
+            del _read_cache[key]
+
+
+def cache_message(session_id: str, message: dict):
+    """Append a just-saved message to the cached history instead of dropping it."""
+    with _read_cache_lock:
+        for key, hit in _read_cache.items():
+            if key[:2] == ("messages", session_id):
+                hit[1].append(dict(message))
+
+
 # ---------------------------------------------------------------------------
 # Chat session management
 # ---------------------------------------------------------------------------
@@ -224,15 +314,20 @@ def create_chat_session(uid: str, id_token: str) -> str | None:
         "userId":    _to_fs_value(uid),
         "createdAt": _to_fs_value(datetime.utcnow().isoformat() + "Z"),
     }
-    resp = requests.patch(url, headers=_fs_headers(id_token),
+    resp = _http().patch(url, headers=_fs_headers(id_token),
                           json={"fields": fields}, timeout=10)
     if resp.status_code == 200:
+        _cache_invalidate("sessions", uid)
         return session_id
     return None
 
 
 def get_user_sessions(uid: str, id_token: str) -> list[dict]:
-    """Fetch all chat sessions for a user, newest first."""
+    """Fetch all chat sessions for a user, newest first (cached for SESSIONS_TTL)."""
+    key = _cache_key("sessions", uid, id_token)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
     project_id = get_project_id()
     url = (
         f"https://firestore.googleapis.com/v1/projects/{project_id}"
@@ -252,7 +347,7 @@ def get_user_sessions(uid: str, id_token: str) -> list[dict]:
             "limit": 20,
         }
     }
-    resp = requests.post(url, headers=_fs_headers(id_token), json=body, timeout=10)
+    resp = _http().post(url, headers=_fs_headers(id_token), json=body, timeout=10)
     sessions = []
     if resp.status_code == 200:
         for item in resp.json():
@@ -262,11 +357,17 @@ def get_user_sessions(uid: str, id_token: str) -> list[dict]:
                 d = _doc_to_dict(doc)
                 d["sessionId"] = name
                 sessions.append(d)
+        _cache_put(key, sessions, SESSIONS_TTL)
     return sessions
 
 
-def save_message(session_id: str, role: str, content: str, id_token: str):
-    """Append a message to a chat session in Firestore."""
+def save_message(session_id: str, role: str, content: str, id_token: str,
+                 timestamp: str | None = None):
+    """Append a message to a chat session in Firestore.
+
+    Pass the time the message was created as timestamp when saving several
+    messages concurrently, so their order in the session is preserved.
+    """
     import uuid
     msg_id = str(uuid.uuid4())
     url = _fs_url(f"messages/{msg_id}")
@@ -274,14 +375,19 @@ def save_message(session_id: str, role: str, content: str, id_token: str):
         "sessionId": _to_fs_value(session_id),
         "role":      _to_fs_value(role),
         "content":   _to_fs_value(content),
-        "timestamp": _to_fs_value(datetime.utcnow().isoformat() + "Z"),
+        "timestamp": _to_fs_value(timestamp or datetime.utcnow().isoformat() + "Z"),
     }
-    requests.patch(url, headers=_fs_headers(id_token),
+    _http().patch(url, headers=_fs_headers(id_token),
                    json={"fields": fields}, timeout=10)
+    _cache_invalidate("messages", session_id)
 
 
 def load_messages(session_id: str, id_token: str) -> list[dict]:
-    """Load all messages for a session, ordered by timestamp."""
+    """Load all messages for a session, ordered by timestamp (cached for MESSAGES_TTL)."""
+    key = _cache_key("messages", session_id, id_token)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
     project_id = get_project_id()
     url = (
         f"https://firestore.googleapis.com/v1/projects/{project_id}"
@@ -300,16 +406,45 @@ def load_messages(session_id: str, id_token: str) -> list[dict]:
             "orderBy": [{"field": {"fieldPath": "timestamp"}, "direction": "ASCENDING"}],
         }
     }
-    resp = requests.post(url, headers=_fs_headers(id_token), json=body, timeout=10)
+    resp = _http().post(url, headers=_fs_headers(id_token), json=body, timeout=10)
     messages = []
     if resp.status_code == 200:
         for item in resp.json():
             doc = item.get("document")
             if doc:
                 messages.append(_doc_to_dict(doc))
+        _cache_put(key, messages, MESSAGES_TTL)
     return messages
 
 
+# ---------------------------------------------------------------------------
+# Concurrent reads — independent Firestore calls of one rerun share the pool
+# ---------------------------------------------------------------------------
+
+READ_WORKERS = 4
+_read_pool = ThreadPoolExecutor(max_workers=READ_WORKERS, thread_name_prefix="firestore-read")
+
+
+def run_concurrently(*calls) -> list:
+    """Run (function, *args) tuples at once on worker threads; results in call order.
+
+    Exceptions are returned in place of results rather than raised.
+    """
+    futures = [_read_pool.submit(fn, *args) for fn, *args in calls]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def prefetch_messages(session_ids: list[str], id_token: str):
+    """Load several sessions' message histories at once into the read cache."""
+    run_concurrently(*[(load_messages, sid, id_token) for sid in session_ids])
+
+
 # ---------------------------------------------------------------------------
 # Session state helpers
 # ---------------------------------------------------------------------------
@@ -363,9 +498,11 @@ def logout():
         "authenticated", "user_id", "user_email", "user_name",
         "id_token", "refresh_token", "session_id",
         "messages", "question_count", "prefill", "uploads",
-        "greeted", "indexed_files", "vectorstore",
+        "greeted", "indexed_files", "vectorstore", "handled_uploads",
     ]
     for k in keys_to_clear:
         if k in st.session_state:
             del st.session_state[k]
+    # New uploader widget, so the next user does not inherit the file left in it
+    st.session_state.uploader_gen = st.session_state.get("uploader_gen", 0) + 1
     st.session_state.auth_page = "login"
@@ -0,0 +1,172 @@
+"""
+FAISS index types for growing corpora.
+Small indexes stay exact (Flat). Larger shared ones switch to HNSW, and very
+large ones to IVF-PQ, which is trained on a sample of the vectors. Every
+conversion measures recall against exact search on held-out vectors and
+logs it.
+"""
+import os
+import math
+import time
+import logging
+from typing import Optional, Tuple
+import numpy as np
+import faiss
+
+logger = logging.getLogger(__name__)
+
+# "auto" picks by size; otherwise any faiss.index_factory string, e.g. "HNSW32" or "IVF1024,PQ48"
+INDEX_FACTORY = os.getenv("INDEX_FACTORY", "auto")
+FLAT_MAX_VECTORS = 20_000
+HNSW_MAX_VECTORS = 500_000
+HNSW_EF_SEARCH = 64
+IVF_NPROBE = 16
+TRAIN_SAMPLE = 100_000
+RECALL_QUERIES = 200
+RECALL_K = 10
+
+
+def choose_index_factory(n: int, factory: str = INDEX_FACTORY) -> str:
+    """Factory string for an index of n vectors."""
+    if factory and factory != "auto":
+        return factory
+    if n <= FLAT_MAX_VECTORS:
+        return "Flat"
+    if n <= HNSW_MAX_VECTORS:
+        return "HNSW32"
+    nlist = 1 << int(math.log2(4 * math.sqrt(n)))
+    return f"IVF{nlist},PQ48"
+
+
+def _ivf(index):
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+
+def index_kind(index) -> str:
+    """"Flat", "HNSW", "IVF" or the faiss class name."""
+    if isinstance(index, faiss.IndexFlat):
+        return "Flat"
+    if hasattr(index, "hnsw"):
+        return "HNSW"
+    if _ivf(index) is not None:
+        return "IVF"
+    return type(index).__name__
+
+
+def index_vectors(index, positions: Optional[np.ndarray] = None) -> np.ndarray:
+    """Stored vectors (all, or at positions); approximate for PQ-compressed indexes."""
+    ivf = _ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    if positions is None:
+        return index.reconstruct_n(0, index.ntotal)
+    return np.vstack([index.reconstruct(int(p)) for p in positions])
+
+
+def search_parameters(index, selector):
+    """SearchParameters of the right subclass so a selector keeps the index's own tuning."""
+    ivf = _ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    if hasattr(index, "hnsw"):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def build_index(vectors: np.ndarray, factory: str, held_out: Optional[np.ndarray] = None):
+    """New index of the given type holding vectors; training skips the held-out rows."""
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    index = faiss.index_factory(vectors.shape[1], factory, faiss.METRIC_L2)
+    if not index.is_trained:
+        pool = np.setdiff1d(np.arange(len(vectors)), held_out) if held_out is not None else np.arange(len(vectors))
+        rng = np.random.default_rng(0)
+        sample = rng.choice(pool, min(len(pool), TRAIN_SAMPLE), replace=False)
+        index.train(vectors[np.sort(sample)])
+    index.add(vectors)
+    ivf = _ivf(index)
+    if ivf is not None:
+        ivf.nprobe = IVF_NPROBE
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    return index
+
+
+def measure_recall(index, vectors: np.ndarray, queries: np.ndarray, k: int = RECALL_K) -> float:
+    """Recall@k of index against exact search, using stored vectors at query positions.
+
+    Each query's own position is left out of both result lists.
+    """
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    q = vectors[queries]
+    _, truth = exact.search(q, k + 1)
+    _, approx = index.search(q, k + 1)
+    hits = 0
+    for qi, t, a in zip(queries, truth, approx):
+        expected = [p for p in t if p != qi][:k]
+        hits += len(set(expected) & {p for p in a if p != qi})
+    return hits / max(1, k * len(queries))
+
+
+def held_out_queries(n: int, count: int = RECALL_QUERIES) -> np.ndarray:
+    rng = np.random.default_rng(1)
+    return np.sort(rng.choice(n, min(n, count), replace=False))
+
+
+def recall_report(vectors: np.ndarray, factory: str) -> dict:
+    """Build an index of one type over vectors and compare it with exact search."""
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    queries = held_out_queries(len(vectors))
+    start = time.perf_counter()
+    index = build_index(vectors, factory, held_out=queries)
+    built = time.perf_counter()
+    recall = measure_recall(index, vectors, queries)
+    searched = time.perf_counter()
+    index.search(vectors[queries], RECALL_K)
+    return {
+        "factory": factory,
+        "vectors": len(vectors),
+        "build_seconds": round(built - start, 2),
+        f"recall@{RECALL_K}": round(recall, 4),
+        "query_ms": round((time.perf_counter() - searched) * 1000 / max(1, len(queries)), 3),
+        "bytes": int(faiss.serialize_index(index).size),
+    }
+
+
+def convert_index(vectorstore, factory: str) -> Tuple[str, float]:
+    """Replace a vectorstore's FAISS index with one of another type, in place.
+
+    Positions are unchanged, so the docstore mapping stays valid. Returns the
+    factory used and the recall measured on held-out vectors.
+    """
+    vectors = index_vectors(vectorstore.index)
+    queries = held_out_queries(len(vectors))
+    index = build_index(vectors, factory, held_out=queries)
+    recall = measure_recall(index, vectors, queries) if factory != "Flat" else 1.0
+    vectorstore.index = index
+    logger.info(f"Converted index of {len(vectors)} vectors to {factory} (recall@{RECALL_K} {recall:.3f})")
+    return factory, recall
+
+
+def factory_kind(factory: str, d: int) -> str:
+    """index_kind of the indexes a factory string builds."""
+    if factory == "Flat":
+        return "Flat"
+    return index_kind(faiss.index_factory(d, factory, faiss.METRIC_L2))
+
+
+def ensure_index_type(vectorstore, factory: str = INDEX_FACTORY) -> bool:
+    """Convert an index to the type its current size calls for; True if converted.
+
+    Runs after every add and delete, so a growing index moves on from Flat to
+    HNSW and then to IVF-PQ.
+    """
+    index = vectorstore.index
+    target = choose_index_factory(index.ntotal, factory)
+    if index.ntotal == 0 or index_kind(index) == factory_kind(target, index.d):
+        return False
+    convert_index(vectorstore, target)
+    return True
@@ -0,0 +1,299 @@
+"""
+Namespaced FAISS index registry.
+Each user (or anonymous browser session) gets its own index directory, so
+concurrent uploads never overwrite each other. Indexes are loaded lazily and
+only the most recently used ones stay resident in this process. Anonymous
+session namespaces are deleted once unused for SESSION_TTL_HOURS.
+"""
+import os
+import re
+import json
+import shutil
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+import streamlit as st
+from vectorstore_utils import (
+    VECTORSTORE_DIR, create_vectorstore, load_vectorstore, save_vectorstore,
+    document_key, document_dir, index_settings, document_ids, remove_from_vectorstore,
+)
+from chunk_store import CHUNKS_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+NAMESPACES_DIR = os.path.join(VECTORSTORE_DIR, "namespaces")
+MANIFEST_FILE = os.path.join(VECTORSTORE_DIR, "manifest.json")
+MAX_RESIDENT_INDEXES = 16
+EXPIRING_KINDS = ("sessions",)   # namespace kinds tied to a browser session, not an account
+SESSION_TTL = float(os.getenv("SESSION_TTL_HOURS", "24")) * 3600
+CLEANUP_INTERVAL = 600
+TOUCH_INTERVAL = 60
+NAMESPACE_FILE_SUFFIXES = (CHUNKS_SUFFIX, ".documents.json")
+
+
+def _safe_part(part) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", str(part)) or "_"
+
+
+class IndexRegistry:
+    """Maps namespaces such as ("users", uid) to on-disk indexes with an LRU of loaded ones."""
+
+    def __init__(self, root: str = NAMESPACES_DIR, max_resident: int = MAX_RESIDENT_INDEXES):
+        self.root = root
+        self.max_resident = max_resident
+        self._resident: "OrderedDict[str, object]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._writers: dict = {}
+        self._touched: dict = {}
+        self._next_cleanup = time.time() + CLEANUP_INTERVAL
+
+    def path(self, namespace: Tuple) -> str:
+        """Directory for a namespace tuple."""
+        return os.path.join(self.root, *(_safe_part(p) for p in namespace))
+
+    def writer_lock(self, namespace: Tuple) -> threading.Lock:
+        """Lock to hold while reading, changing and putting back a namespace's index."""
+        with self._lock:
+            return self._writers.setdefault(self.path(namespace), threading.Lock())
+
+    def _remember(self, path: str, vectorstore):
+        self._resident[path] = vectorstore
+        self._resident.move_to_end(path)
+        while len(self._resident) > self.max_resident:
+            self._resident.popitem(last=False)
+
+    def _touch(self, path: str):
+        """Record use of a namespace as its directory mtime, which expiry reads."""
+        now = time.time()
+        if now - self._touched.get(path, 0) < TOUCH_INTERVAL:
+            return
+        self._touched[path] = now
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        if now >= self._next_cleanup:
+            self._next_cleanup = now + CLEANUP_INTERVAL
+            threading.Thread(target=self.remove_expired, daemon=True).start()
+
+    def get_path(self, path: str):
+        """Return the index stored at path, loading it on first use."""
+        self._touch(path)
+        with self._lock:
+            if path in self._resident:
+                self._resident.move_to_end(path)
+                return self._resident[path]
+        vectorstore = load_vectorstore(path)
+        if vectorstore is not None:
+            with self._lock:
+                self._remember(path, vectorstore)
+        return vectorstore
+
+    def get(self, namespace: Tuple):
+        """Index bound to a namespace, or None if it has none yet."""
+        return self.get_path(self.path(namespace))
+
+    def put(self, namespace: Tuple, vectorstore):
+        """Persist a namespace's index and keep it resident."""
+        path = self.path(namespace)
+        save_vectorstore(vectorstore, path, overwrite=True)
+        with self._lock:
+            self._remember(path, vectorstore)
+
+    def drop(self, namespace: Tuple):
+        """Forget a namespace's resident index (the files stay on disk)."""
+        with self._lock:
+            self._resident.pop(self.path(namespace), None)
+
+    def delete(self, namespace: Tuple):
+        """Delete a namespace's index and its sibling files."""
+        path = self.path(namespace)
+        with self.writer_lock(namespace):
+            with self._lock:
+                self._resident.pop(path, None)
+                self._touched.pop(path, None)
+            shutil.rmtree(path, ignore_errors=True)
+            for suffix in NAMESPACE_FILE_SUFFIXES:
+                try:
+                    os.remove(path + suffix)
+                except OSError:
+                    pass
+        with self._lock:
+            self._writers.pop(path, None)
+
+    def remove_expired(self, ttl: float = SESSION_TTL) -> int:
+        """Delete session namespaces unused for ttl seconds; returns how many were removed."""
+        removed = 0
+        cutoff = time.time() - ttl
+        for kind in EXPIRING_KINDS:
+            kind_dir = os.path.join(self.root, kind)
+            try:
+                names = os.listdir(kind_dir)
+            except OSError:
+                continue
+            stems = set()
+            for name in names:
+                if name.startswith((".tmp-", ".old-")):
+                    continue
+                for suffix in NAMESPACE_FILE_SUFFIXES:
+                    if name.endswith(suffix):
+                        name = name[:-len(suffix)]
+                stems.add(name)
+            for stem in stems:
+                path = os.path.join(kind_dir, stem)
+                candidates = [path] + [path + suffix for suffix in NAMESPACE_FILE_SUFFIXES]
+                mtimes = [os.path.getmtime(p) for p in candidates if os.path.exists(p)]
+                if mtimes and max(mtimes) < cutoff:
+                    try:
+                        self.delete((kind, stem))
+                        removed += 1
+                    except Exception as e:
+                        logger.warning(f"Could not delete expired namespace {path}: {e}")
+        if removed:
+            logger.info(f"Deleted {removed} expired session indexes")
+        return removed
+
+    def documents(self, namespace: Tuple) -> List[dict]:
+        """[{doc_id, source}] for the documents in a namespace's index."""
+        vectorstore = self.get(namespace)
+        if vectorstore is None:
+            return []
+        docs = []
+        for doc_id in sorted(document_ids(vectorstore)):
+            first = vectorstore.docstore.search(f"{doc_id}-0")
+            source = first.metadata.get("source") if hasattr(first, "metadata") else None
+            docs.append({"doc_id": doc_id, "source": source or doc_id[:8]})
+        return docs
+
+    def remove_document(self, namespace: Tuple, doc_id: str) -> int:
+        """Remove a document from a namespace's index; returns the number of chunks removed.
+
+        Works on a private copy read from disk and swaps it in once saved, so
+        searches on the resident index are never affected by a half-done change.
+        """
+        with self.writer_lock(namespace):
+            vectorstore = load_vectorstore(self.path(namespace))
+            if vectorstore is None:
+                return 0
+            removed = remove_from_vectorstore(vectorstore, doc_id)
+            if removed:
+                self.put(namespace, vectorstore)
+            return removed
+
+    def get_document(self, text: str):
+        """Shared, content-addressed index for a document, built on first use."""
+        path = document_dir(document_key(text))
+        vectorstore = self.get_path(path)
+        if vectorstore is None:
+            vectorstore = create_vectorstore(text)
+            if vectorstore is not None:
+                with self._lock:
+                    self._remember(path, vectorstore)
+        return vectorstore
+
+
+@st.cache_resource(show_spinner=False)
+def get_index_registry() -> IndexRegistry:
+    """Process-wide registry shared by every session on this worker."""
+    return IndexRegistry()
+
+
+def read_text(data_file: str) -> str:
+    with open(data_file, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _default_index_state(data_file: str, mtime: float) -> dict:
+    """The file's text and expected manifest, read and hashed once per file version."""
+    text = read_text(data_file)
+    return {"text": text, "expected": expected_manifest(text), "current": False}
+
+
+def expected_manifest(text: str) -> dict:
+    """What the default index must have been built from: text hash, model and splitter settings."""
+    return {
+        "text_sha256": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+        "key": document_key(text),
+        **index_settings(),
+    }
+
+
+def read_manifest(data_file: str) -> Optional[dict]:
+    try:
+        with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+            return json.load(f).get(os.path.normpath(data_file))
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(data_file: str, entry: dict):
+    try:
+        with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+            manifests = json.load(f)
+    except (OSError, ValueError):
+        manifests = {}
+    manifests[os.path.normpath(data_file)] = entry
+    os.makedirs(os.path.dirname(MANIFEST_FILE), exist_ok=True)
+    tmp = MANIFEST_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifests, f, indent=2)
+    os.replace(tmp, MANIFEST_FILE)
+
+
+def default_index_is_current(data_file: str, text: str) -> bool:
+    """True when the manifest matches the file and settings and the index is on disk."""
+    return _matches_manifest(data_file, expected_manifest(text))
+
+
+def _matches_manifest(data_file: str, expected: dict) -> bool:
+    recorded = read_manifest(data_file) or {}
+    return (all(recorded.get(k) == v for k, v in expected.items())
+            and os.path.exists(os.path.join(document_dir(expected["key"]), "index.faiss")))
+
+
+def build_default_index(data_file: str):
+    """Validate the default index against its manifest, rebuilding only on mismatch.
+
+    Returns (vectorstore, rebuilt). Used by build_index.py before the server starts.
+    """
+    text = read_text(data_file)
+    expected = expected_manifest(text)
+    if default_index_is_current(data_file, text):
+        return load_vectorstore(document_dir(expected["key"])), False
+    start = time.perf_counter()
+    vectorstore = create_vectorstore(text)
+    if vectorstore is None:
+        return None, True
+    write_manifest(data_file, {
+        **expected,
+        "data_file": os.path.normpath(data_file),
+        "chunks": vectorstore.index.ntotal,
+        "build_seconds": round(time.perf_counter() - start, 1),
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    })
+    return vectorstore, True
+
+
+def get_default_vectorstore(data_file: str) -> Optional[object]:
+    """Index for the bundled syllabus file, shared by all sessions.
+
+    Normally prebuilt by build_index.py; building here is the fallback.
+    """
+    if not os.path.exists(data_file):
+        return None
+    # Hashed once per file version; the manifest is checked only until it matches
+    state = _default_index_state(data_file, os.path.getmtime(data_file))
+    if not state["current"]:
+        if not _matches_manifest(data_file, state["expected"]):
+            logger.warning(f"Default index for {data_file} is missing or stale; building it in this session. "
+                           "Run python build_index.py before starting the server.")
+            vectorstore, _ = build_default_index(data_file)
+            return vectorstore
+        state["current"] = True
+    registry = get_index_registry()
+    vectorstore = registry.get_path(document_dir(state["expected"]["key"]))
+    return vectorstore if vectorstore is not None else registry.get_document(state["text"])
@@ -0,0 +1,269 @@
+"""
+Background ingestion of uploaded PDFs.
+Uploads become jobs on a small thread pool with a bounded number of pending
+jobs, so parsing and embedding survive reruns and never block the page. Each
+job builds the new index from a private copy of its namespace's saved index
+and swaps it into the registry when done; until then sessions keep chatting
+against the previous one. The UI polls jobs by id for per-stage progress.
+Removing a document runs on the same pool, since it can mean rebuilding an
+HNSW index.
+Identical files are parsed and embedded once (see upload_dedup).
+"""
+import os
+import time
+import uuid
+import queue
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, Optional, Tuple
+import streamlit as st
+from pdf_extract import iter_pdf_pages, count_pages, MAX_PDF_PAGES
+from vectorstore_utils import attach_document, build_document, document_dir, load_vectorstore
+from upload_dedup import file_hash, single_flight
+
+logger = logging.getLogger(__name__)
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "8"))   # queued + running jobs per process
+JOB_TTL = 3600           # finished jobs are forgotten after an hour
+PREVIEW_CHARS = 200
+POLL_SECONDS = 1.0
+
+
+class IngestJob:
+    """One uploaded PDF on its way into a namespace's index."""
+
+    def __init__(self, namespace: Tuple, name: str, size: int, data: bytes):
+        self.id = uuid.uuid4().hex
+        self.namespace = namespace
+        self.name = name
+        self.size = size
+        self.status = "queued"        # queued, running, done or failed
+        self.pages_total = min(count_pages(data), MAX_PDF_PAGES)
+        self.pages_parsed = 0
+        self.chunks_embedded = 0
+        self.shared = False           # waiting for another upload of the same file
+        self.preview = ""
+        self.doc_id: Optional[str] = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self._data: Optional[bytes] = data
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running")
+
+    @property
+    def progress(self) -> float:
+        """Fraction of pages parsed, 0.0-1.0."""
+        if self.status == "done":
+            return 1.0
+        return self.pages_parsed / self.pages_total if self.pages_total else 0.0
+
+    @property
+    def stage(self) -> str:
+        """Human-readable stage for progress displays."""
+        if self.status == "queued":
+            return "Waiting in queue"
+        if self.status == "running":
+            if self.shared:
+                return "Same file is being indexed for another upload; waiting for it"
+            if self.pages_parsed < self.pages_total:
+                return f"Parsed {self.pages_parsed}/{self.pages_total} pages, embedded {self.chunks_embedded} chunks"
+            return f"Embedded {self.chunks_embedded} chunks, saving index"
+        if self.status == "done":
+            return f"Indexed {self.pages_total} pages ({self.chunks_embedded} chunks)"
+        return f"Failed: {self.error}"
+
+    def _pages(self) -> Iterator[Tuple[int, str]]:
+        for page_no, text in iter_pdf_pages(self._data, MAX_PDF_PAGES):
+            if not self.preview:
+                self.preview = text.strip()[:PREVIEW_CHARS]
+            self.pages_parsed += 1
+            yield page_no, text
+        self._data = None
+
+    def _embedded(self, count: int):
+        self.chunks_embedded = count
+
+    def _build(self) -> dict:
+        """Parse and embed the file into its shared document index."""
+        doc_vs, key = build_document(self._pages(), progress=self._embedded)
+        return {"doc_key": key, "pages": self.pages_parsed, "chunks": doc_vs.index.ntotal,
+                "preview": self.preview}
+
+    def _reuse(self, record: dict):
+        self.shared = False
+        self.pages_parsed = record.get("pages", self.pages_total)
+        self.chunks_embedded = record.get("chunks", 0)
+        self.preview = self.preview or record.get("preview", "")
+
+
+class RemovalJob:
+    """Removal of one document's chunks from a namespace's index."""
+
+    def __init__(self, namespace: Tuple, name: str, doc_id: str):
+        self.id = uuid.uuid4().hex
+        self.namespace = namespace
+        self.name = name
+        self.doc_id = doc_id
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.finished: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running")
+
+
+class IngestQueue:
+    """Runs ingestion jobs in worker threads; writes to one namespace run one at a time."""
+
+    def __init__(self, workers: int = INGEST_WORKERS, max_pending: int = INGEST_QUEUE_SIZE):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="ingest")
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._jobs: Dict[str, IngestJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, registry, namespace: Tuple, name: str, data: bytes, size: int = 0) -> IngestJob:
+        """Queue a PDF for a namespace's index; raises queue.Full when too many jobs are pending."""
+        if not self._slots.acquire(blocking=False):
+            raise queue.Full("Too many documents are being processed; try again shortly")
+        try:
+            job = IngestJob(namespace, name, size or len(data), data)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._forget_finished()
+            self._jobs[job.id] = job
+        self._pool.submit(self._run, job, registry)
+        return job
+
+    def submit_removal(self, registry, namespace: Tuple, doc_id: str, name: str = "") -> RemovalJob:
+        """Queue removal of a document from a namespace's index (not counted against the upload cap)."""
+        job = RemovalJob(namespace, name or doc_id, doc_id)
+        with self._lock:
+            self._forget_finished()
+            self._jobs[job.id] = job
+        self._pool.submit(self._remove, job, registry)
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _forget_finished(self):
+        cutoff = time.time() - JOB_TTL
+        for job_id in [i for i, j in self._jobs.items() if j.finished and j.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def _run(self, job: IngestJob, registry):
+        job.status = "running"
+        try:
+            # One build per distinct file, across sessions and worker processes
+            record = single_flight(file_hash(job._data), job._build, on_wait=lambda: setattr(job, "shared", True))
+            job._reuse(record)
+            doc_id = record["doc_key"]
+            doc_vs = load_vectorstore(document_dir(doc_id))
+            if doc_vs is None:
+                raise ValueError("document index is missing")
+            with registry.writer_lock(job.namespace):
+                # Private copy from disk: the resident index keeps serving searches meanwhile
+                base = load_vectorstore(registry.path(job.namespace))
+                vectorstore = attach_document(base, doc_vs, doc_id, source=job.name)
+                registry.put(job.namespace, vectorstore)
+            job.doc_id = doc_id
+            job.status = "done"
+        except Exception as e:
+            logger.error(f"Ingestion of {job.name} failed: {e}")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job._data = None
+            job.finished = time.time()
+            self._slots.release()
+
+
+    def _remove(self, job: RemovalJob, registry):
+        job.status = "running"
+        try:
+            registry.remove_document(job.namespace, job.doc_id)
+            job.status = "done"
+        except Exception as e:
+            logger.error(f"Removing {job.name} failed: {e}")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished = time.time()
+
+
+@st.cache_resource(show_spinner=False)
+def get_ingest_queue() -> IngestQueue:
+    """Process-wide ingestion queue shared by every session on this worker."""
+    return IngestQueue()
+
+
+def polling(active: bool):
+    """Decorator that reruns a status panel every POLL_SECONDS while jobs are active.
+
+    Uses st.fragment (or st.experimental_fragment) when available; on older
+    Streamlit the panel refreshes with the next interaction instead.
+    """
+    fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+    if fragment is None:
+        return lambda f: f
+    return fragment(run_every=POLL_SECONDS if active else None)
+
+
+def submit_upload(registry, namespace: Tuple, uploaded_file, jobs: Dict[str, str]) -> Optional[IngestJob]:
+    """Queue a Streamlit upload and remember its job id in jobs (file name -> job id)."""
+    try:
+        job = get_ingest_queue().submit(
+            registry, namespace, uploaded_file.name, uploaded_file.getvalue(), uploaded_file.size
+        )
+    except queue.Full as e:
+        st.warning(f"⏳ {e}")
+        return None
+    except Exception as e:
+        st.error(f"❌ Error processing PDF: {str(e)}")
+        return None
+    jobs[uploaded_file.name] = job.id
+    return job
+
+
+def render_jobs(jobs: Dict[str, str], on_done: Callable[[IngestJob], None], current: Optional[str] = None):
+    """Show progress for a session's jobs and attach the finished ones.
+
+    on_done(job) runs once per finished job, then the page reruns so it picks
+    up the new index. A failed job stays listed while its file is still in the
+    uploader (current), so the same file is not resubmitted on every rerun.
+    """
+    ingest = get_ingest_queue()
+    for name in list(jobs):
+        job = ingest.get(jobs[name])
+        if job is None or (job.status == "failed" and name != current):
+            del jobs[name]
+    active = any(job.active for job in map(ingest.get, jobs.values()) if job)
+
+    @polling(active)
+    def panel():
+        finished = False
+        for name, job_id in list(jobs.items()):
+            job = ingest.get(job_id)
+            if job is None:
+                jobs.pop(name, None)
+            elif job.active:
+                st.progress(job.progress, text=f"📄 {name}: {job.stage}")
+            elif job.status == "done":
+                jobs.pop(name, None)
+                on_done(job)
+                finished = True
+            else:
+                st.error(f"❌ {name}: {job.stage}")
+        if finished:
+            st.rerun()
+
+    panel()
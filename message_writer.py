@@ -0,0 +1,329 @@
+"""
+Write-behind persistence for chat messages.
+Messages are queued in memory, then a background thread commits them to
+Firestore in batches with the documents:commit endpoint; commits keep each
+session's order. Every queued message is also appended to a private spool
+file (one per process), so a crash loses nothing: spools of dead processes
+are taken over and their messages replayed. ID tokens are never written to
+disk: each user's latest token is kept in memory, so replayed messages, and
+ones whose token expired or that kept failing, wait until that user next
+sends a message. Batches Firestore rejects go to a private dead-letter file.
+"""
+import os
+import json
+import time
+import uuid
+import atexit
+import logging
+import threading
+from datetime import datetime
+import streamlit as st
+from firebase_auth import (
+    _http, _fs_headers, _to_fs_value, get_project_id, cache_message, load_messages,
+)
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 0.5               # seconds to wait for more messages before committing
+MAX_BATCH = 200                    # Firestore allows up to 500 writes per commit
+MAX_BACKOFF = 30.0
+MAX_ATTEMPTS = 8                   # then the batch is dead-lettered
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+SPOOL_DIR = os.getenv(
+    "CHAT_SPOOL_DIR", os.path.join(os.path.expanduser("~"), ".exam_assistant", "spool")
+)
+SPOOL_HEARTBEAT_SECONDS = 30       # a live writer touches its spool this often
+SPOOL_STALE_SECONDS = 120          # a spool untouched this long belongs to a dead process
+DEAD_LETTER_DIR = os.getenv(
+    "CHAT_DEAD_LETTER_DIR", os.path.join(os.path.expanduser("~"), ".exam_assistant", "dead_letter")
+)
+
+
+class MessageWriter:
+    """Queue of pending message writes flushed to Firestore by a daemon thread."""
+
+    def __init__(self, dead_letter_dir: str = DEAD_LETTER_DIR, spool_dir: str = SPOOL_DIR):
+        # One file per process, so workers never rewrite each other's lines
+        self.dead_letter_path = os.path.join(dead_letter_dir, f"messages-{os.getpid()}.jsonl")
+        self.spool_dir = spool_dir
+        self.spool_path = os.path.join(spool_dir, f"messages-{os.getpid()}.jsonl")
+        self._pending: list[dict] = []
+        self._parked: dict[str, list[dict]] = {}   # owner -> entries waiting for their next token
+        self._tokens: dict[str, str] = {}   # owner (uid) -> latest ID token, memory only
+        self._cond = threading.Condition()
+        self._spool = self._open_spool()
+        self._heartbeat_at = time.monotonic()
+        with self._cond:
+            self._take_over_spools()
+        self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush, 2.0)
+
+    # -- public API ----------------------------------------------------------
+
+    def enqueue(self, session_id: str, role: str, content: str, id_token: str,
+                timestamp: str | None = None, uid: str | None = None) -> dict:
+        """Queue a message for saving and return it as load_messages would.
+
+        uid identifies whose token signs the write; a newer token passed for
+        the same uid is used for that user's messages still in the queue.
+        """
+        message = {
+            "sessionId": session_id,
+            "role":      role,
+            "content":   content,
+            "timestamp": timestamp or datetime.utcnow().isoformat() + "Z",
+        }
+        owner = uid or session_id
+        entry = {
+            "id":       str(uuid.uuid4()),
+            "database": f"projects/{get_project_id()}/databases/(default)",
+            "owner":    owner,
+            "message":  message,
+            "attempts": 0,
+            "retry_at": 0.0,
+        }
+        with self._cond:
+            self._tokens[owner] = id_token
+            # Messages kept from a crash or an expired token go out with this fresh one
+            for parked in self._parked.pop(owner, []):
+                parked["attempts"], parked["retry_at"] = 0, 0.0
+                self._pending.append(parked)
+            self._pending.append(entry)
+            self._spool_write([_spool_record(entry)])
+            self._cond.notify()
+        cache_message(session_id, message)
+        return message
+
+    def pending_for(self, session_id: str) -> list[dict]:
+        """Messages of a session that are queued but not yet committed."""
+        with self._cond:
+            entries = self._pending + [e for parked in self._parked.values() for e in parked]
+            return [dict(e["message"]) for e in entries if e["message"]["sessionId"] == session_id]
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Block until the queue drains or timeout passes; True if drained."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify()
+            while self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(min(remaining, 0.1))
+        return True
+
+    # -- spool ----------------------------------------------------------------
+
+    def _open_spool(self):
+        try:
+            os.makedirs(self.spool_dir, mode=0o700, exist_ok=True)
+            fd = os.open(self.spool_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+            return os.fdopen(fd, "a", encoding="utf-8")
+        except OSError as err:
+            logger.error(f"No chat spool file, queued messages will not survive a restart: {err}")
+            return None
+
+    def _spool_write(self, records: list[dict]):
+        """Append records; flushed to the OS, so they survive the process being killed."""
+        if self._spool is None or not records:
+            return
+        try:
+            for record in records:
+                self._spool.write(json.dumps(record) + "\n")
+            self._spool.flush()
+        except OSError as err:
+            logger.error(f"Could not write chat spool: {err}")
+
+    def _spool_done(self, batch: list[dict]):
+        """Mark entries as settled; empty the spool once nothing is outstanding."""
+        if self._spool is None:
+            return
+        if not self._pending and not self._parked:
+            try:
+                self._spool.truncate(0)
+            except OSError as err:
+                logger.error(f"Could not truncate chat spool: {err}")
+            return
+        self._spool_write([{"done": e["id"]} for e in batch])
+
+    def _take_over_spools(self):
+        """Adopt the spools of dead processes; call with the condition held.
+
+        A spool is claimed by renaming it, so of several live writers only one
+        takes it. Its messages are re-spooled here and parked for their owner.
+        """
+        try:
+            names = os.listdir(self.spool_dir)
+        except OSError:
+            return
+        known = {e["id"] for e in self._pending} | {e["id"] for p in self._parked.values() for e in p}
+        for name in names:
+            path = os.path.join(self.spool_dir, name)
+            if path == self.spool_path or not name.startswith("messages-"):
+                continue
+            claimed = f"{self.spool_path}.{name}.claimed"
+            try:
+                if time.time() - os.path.getmtime(path) <= SPOOL_STALE_SECONDS:
+                    continue
+                os.rename(path, claimed)
+            except OSError:
+                continue   # live, or taken by another writer
+            recovered = [e for e in _read_spool(claimed) if e["id"] not in known]
+            self._spool_write([_spool_record(e) for e in recovered])
+            for e in recovered:
+                self._parked.setdefault(e["owner"], []).append(e)
+            try:
+                os.remove(claimed)
+            except OSError:
+                pass
+            if recovered:
+                logger.info(f"Recovered {len(recovered)} unsaved chat messages from {name}")
+
+    def _heartbeat(self):
+        """Keep this writer's spool fresh and adopt those of processes that died since."""
+        if time.monotonic() - self._heartbeat_at < SPOOL_HEARTBEAT_SECONDS:
+            return
+        self._heartbeat_at = time.monotonic()
+        try:
+            os.utime(self.spool_path)
+        except OSError:
+            pass
+        with self._cond:
+            self._take_over_spools()
+
+    # -- background commit loop ---------------------------------------------
+
+    def _next_batch(self, now: float) -> list[dict]:
+        """Oldest due entries that can share one commit (same database and owner)."""
+        first = next(e for e in self._pending if e["retry_at"] <= now)
+        group = (first["database"], first["owner"])
+        return [e for e in self._pending
+                if (e["database"], e["owner"]) == group and e["retry_at"] <= now][:MAX_BATCH]
+
+    def _commit(self, batch: list[dict], token: str) -> int:
+        database = batch[0]["database"]
+        writes = [{
+            "update": {
+                "name": f"{database}/documents/messages/{e['id']}",
+                "fields": {k: _to_fs_value(v) for k, v in e["message"].items()},
+            }
+        } for e in batch]
+        resp = _http().post(
+            f"https://firestore.googleapis.com/v1/{database}/documents:commit",
+            headers=_fs_headers(token), json={"writes": writes}, timeout=10,
+        )
+        return resp.status_code
+
+    def _dead_letter(self, batch: list[dict], reason: str):
+        """Keep rejected messages (without tokens) in a file only this user can read."""
+        logger.error(f"Giving up on {len(batch)} chat messages ({reason}); saved to {self.dead_letter_path}")
+        try:
+            os.makedirs(os.path.dirname(self.dead_letter_path), mode=0o700, exist_ok=True)
+            fd = os.open(self.dead_letter_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+            with os.fdopen(fd, "a", encoding="utf-8") as f:
+                for e in batch:
+                    f.write(json.dumps({"id": e["id"], "database": e["database"], "owner": e["owner"],
+                                        "message": e["message"], "reason": reason}) + "\n")
+        except OSError as err:
+            logger.error(f"Could not write dead-letter file: {err}")
+
+    def _wait_for_due(self, timeout: float) -> bool:
+        """Block until some pending entry is due or timeout passes; call with the condition held."""
+        deadline = time.monotonic() + timeout
+        while True:
+            now = time.monotonic()
+            due = min((e["retry_at"] for e in self._pending), default=deadline)
+            if self._pending and due <= now:
+                return True
+            if now >= deadline:
+                return False
+            self._cond.wait(min(due, deadline) - now)
+
+    def _run(self):
+        while True:
+            self._heartbeat()
+            with self._cond:
+                if not self._wait_for_due(SPOOL_HEARTBEAT_SECONDS):
+                    continue
+            # Give the rest of the chat turn a moment to arrive in the same batch
+            time.sleep(FLUSH_INTERVAL)
+            with self._cond:
+                batch = self._next_batch(time.monotonic())
+                token = self._tokens.get(batch[0]["owner"])
+            try:
+                status = self._commit(batch, token)
+            except Exception as e:
+                logger.warning(f"Message commit failed, will retry: {e}")
+                status = None
+
+            with self._cond:
+                owner = batch[0]["owner"]
+                attempts = batch[0]["attempts"] + 1
+                refreshed = self._tokens.get(owner) != token
+                park = False
+                if status == 200:
+                    pass
+                elif status is None or status in RETRYABLE_STATUSES or (status == 401 and refreshed):
+                    # Transient failure, or an expired token the user has since replaced
+                    if attempts < MAX_ATTEMPTS:
+                        retry_at = time.monotonic() + (0 if status == 401 else min(MAX_BACKOFF, 2 ** attempts))
+                        for e in batch:
+                            e["attempts"], e["retry_at"] = attempts, retry_at
+                        continue
+                    logger.warning(f"{len(batch)} chat messages still failing after {attempts} attempts; "
+                                   "kept for the user's next message")
+                    park = True
+                elif status == 401:
+                    park = True   # expired token: the user's next message brings a fresh one
+                else:
+                    self._dead_letter(batch, f"Firestore returned {status}")
+                sent = {e["id"] for e in batch}
+                self._pending = [e for e in self._pending if e["id"] not in sent]
+                if park:
+                    self._parked.setdefault(owner, []).extend(batch)
+                else:
+                    self._spool_done(batch)
+                if not any(e["owner"] == owner for e in self._pending):
+                    self._tokens.pop(owner, None)
+                self._cond.notify_all()
+
+
+def _spool_record(entry: dict) -> dict:
+    return {k: entry[k] for k in ("id", "database", "owner", "message")}
+
+
+def _read_spool(path: str) -> list[dict]:
+    """Entries of a spool file that were never marked done, in queue order."""
+    entries: dict[str, dict] = {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue   # torn last line of a killed process
+                if "done" in record:
+                    entries.pop(record["done"], None)
+                elif "id" in record:
+                    entries[record["id"]] = {**record, "attempts": 0, "retry_at": 0.0}
+    except OSError as err:
+        logger.error(f"Could not read chat spool {path}: {err}")
+    return list(entries.values())
+
+
+@st.cache_resource(show_spinner=False)
+def get_message_writer() -> MessageWriter:
+    """Process-wide writer shared by every session."""
+    return MessageWriter()
+
+
+def load_session_messages(session_id: str, id_token: str) -> list[dict]:
+    """Stored messages of a session plus any still waiting in the write-behind queue."""
+    stored = load_messages(session_id, id_token)
+    seen = {(m.get("timestamp"), m.get("role"), m.get("content")) for m in stored}
+    pending = [m for m in get_message_writer().pending_for(session_id)
+               if (m["timestamp"], m["role"], m["content"]) not in seen]
+    if not pending:
+        return stored
+    return sorted(stored + pending, key=lambda m: m.get("timestamp") or "")
@@ -0,0 +1,76 @@
+"""
+Convert saved indexes to the current pickle-free layout.
+
+Usage:
+    python migrate_indexes.py            # everything under vectorstore/
+    python migrate_indexes.py some/dir --dry-run
+
+Older versions kept chunk text in index.pkl, which can only be read by
+unpickling it, or in a chunks.sqlite inside the index directory. The app
+no longer reads index.pkl at all. build_index.py runs this on vectorstore/
+at every start; run it by hand only for other directories of your own
+(never on files from elsewhere). It re-saves each index with index.faiss,
+ids.json and an append-only "<dir>.chunks.sqlite".
+"""
+import os
+import sys
+import argparse
+import faiss
+from langchain_community.vectorstores import FAISS
+from chunk_store import ChunkStore, LEGACY_CHUNKS_FILE, IDS_FILE
+from vectorstore_utils import VECTORSTORE_DIR, save_vectorstore
+
+
+def legacy_indexes(root):
+    """Index directories under root that are not in the current layout.
+
+    vectorstore/ itself is never one: the single global index older versions
+    saved there is no longer read. Nor is any directory with subdirectories,
+    since converting replaces the whole directory.
+    """
+    top = os.path.abspath(VECTORSTORE_DIR)
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith((".tmp-", ".old-"))]
+        if os.path.abspath(dirpath) == top or dirnames:
+            continue
+        if "index.faiss" in filenames and IDS_FILE not in filenames:
+            if "index.pkl" in filenames or LEGACY_CHUNKS_FILE in filenames:
+                yield dirpath
+
+
+def load_legacy(path):
+    if os.path.exists(os.path.join(path, LEGACY_CHUNKS_FILE)):
+        docstore = ChunkStore(os.path.join(path, LEGACY_CHUNKS_FILE))
+        index = faiss.read_index(os.path.join(path, "index.faiss"))
+        return FAISS(None, index, docstore, docstore.id_mapping())
+    # Trusted local file written by this app's earlier versions
+    return FAISS.load_local(path, None, allow_dangerous_deserialization=True)
+
+
+def migrate(root=VECTORSTORE_DIR, dry_run=False):
+    """Convert every legacy index under root; returns how many failed."""
+    failed = 0
+    for path in legacy_indexes(root):
+        if dry_run:
+            print(f"would convert {path}")
+            continue
+        try:
+            vectorstore = load_legacy(path)
+            save_vectorstore(vectorstore, path, overwrite=True)
+            print(f"converted {path} ({vectorstore.index.ntotal} chunks)")
+        except Exception as e:
+            failed += 1
+            print(f"FAILED {path}: {e}")
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root", nargs="?", default=VECTORSTORE_DIR)
+    parser.add_argument("--dry-run", action="store_true", help="list what would be converted")
+    args = parser.parse_args(argv)
+    return 1 if migrate(args.root, args.dry_run) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+Shared PDF text extraction.
+Pages are extracted by a process pool in page ranges and yielded in order as
+a (page_number, text) generator, so callers can split and embed while later
+pages are still being parsed. Small PDFs are read serially.
+"""
+import io
+import os
+import tempfile
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterator, Optional, Tuple
+from PyPDF2 import PdfReader
+
+logger = logging.getLogger(__name__)
+
+MAX_PDF_PAGES = 500        # safety cap for every upload path
+PARALLEL_MIN_PAGES = 24    # below this, process start-up costs more than it saves
+PAGES_PER_TASK = 12
+MAX_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawn, not fork: callers are multithreaded (Streamlit, torch, ingest workers)
+            _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _reset_pool(broken: ProcessPoolExecutor):
+    """Replace the shared pool, but only if it is still the one that broke."""
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _extract_range(path: str, start: int, stop: int) -> list:
+    """Worker: extract pages [start, stop) from the PDF at path."""
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def count_pages(data: bytes) -> int:
+    """Number of pages in a PDF without extracting any text."""
+    return len(PdfReader(io.BytesIO(data)).pages)
+
+
+def _iter_serial(data: bytes, total: int) -> Iterator[Tuple[int, str]]:
+    reader = PdfReader(io.BytesIO(data))
+    for i in range(total):
+        yield i + 1, reader.pages[i].extract_text() or ""
+
+
+def iter_pdf_pages(data: bytes, max_pages: Optional[int] = MAX_PDF_PAGES) -> Iterator[Tuple[int, str]]:
+    """Yield (page_number, text) for each page, 1-based and in order."""
+    total = count_pages(data)
+    if max_pages is not None:
+        total = min(total, max_pages)
+    if total < PARALLEL_MIN_PAGES or MAX_WORKERS < 2:
+        yield from _iter_serial(data, total)
+        return
+
+    # Workers read the PDF from a temp file instead of receiving the bytes per task
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        ranges = [(start, min(start + PAGES_PER_TASK, total)) for start in range(0, total, PAGES_PER_TASK)]
+        pool = None
+        try:
+            pool = _get_pool()
+            futures = [pool.submit(_extract_range, path, start, stop) for start, stop in ranges]
+        except Exception as e:
+            logger.warning(f"Parallel PDF extraction unavailable, reading serially: {e}")
+            if isinstance(e, BrokenProcessPool):
+                _reset_pool(pool)
+            yield from _iter_serial(data, total)
+            return
+
+        reader = None
+        try:
+            for (start, stop), future in zip(ranges, futures):
+                try:
+                    texts = future.result()
+                except Exception as e:
+                    # Retry just this range here; other sessions' ranges keep their workers
+                    logger.warning(f"PDF pages {start + 1}-{stop} failed in a worker, reading them serially: {e}")
+                    if isinstance(e, BrokenProcessPool):
+                        _reset_pool(pool)
+                    if reader is None:
+                        reader = PdfReader(io.BytesIO(data))
+                    texts = [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+                for i, text in enumerate(texts, start + 1):
+                    yield i, text
+        finally:
+            for future in futures:
+                future.cancel()
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def extract_pdf_text(data: bytes, max_pages: Optional[int] = MAX_PDF_PAGES) -> Tuple[str, int]:
+    """Whole-document text plus the number of pages read."""
+    parts, pages = [], 0
+    for pages, text in iter_pdf_pages(data, max_pages):
+        parts.append(text)
+    return "\n".join(parts).strip(), pages
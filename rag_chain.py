@@ -1,8 +1,52 @@
+import re
+import time
+import weakref
+import logging
+import threading
+import httpx
 import streamlit as st
 from langchain_groq import ChatGroq
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+from retrieval import retrieve, freeze_filters
+
+logger = logging.getLogger(__name__)
+
+RAG_MODEL = "llama-3.1-8b-instant"
+RAG_TEMPERATURE = 0.2
+RETRIEVAL_K = 3
+
+# marks -> (chunks retrieved, context token budget); short answers need little context
+CONTEXT_PROFILES = {
+    1:  (2, 300),
+    2:  (3, 500),
+    5:  (4, 1000),
+    10: (6, 1800),
+    12: (8, 2400),
+}
+DEFAULT_PROFILE = (RETRIEVAL_K, 1000)
+MERGE_OVERLAP = 250   # longest chunk overlap looked for when joining neighbours
+
+RAG_TEMPLATE = """You are an expert exam assistant. Use the following context to answer accurately.
+
+Context: {context}
+
+Question: {question}
+
+Instructions:
+- Provide accurate, well-structured answers
+- For 1-2 marks: concise, direct answers
+- For 10-12 marks: detailed, structured explanations with headings
+- If information is not in the context, say so clearly
+
+Answer:"""
+
+RAG_PROMPT = ChatPromptTemplate.from_template(RAG_TEMPLATE)
+
+# vectorstore -> {(model, temperature, marks, filters): chain}; entries go away with the index
+_chains: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_chains_lock = threading.Lock()
 
 
 def get_groq_api_key() -> str:
@@ -21,49 +65,173 @@ def get_groq_api_key() -> str:
 
 
 @st.cache_resource(show_spinner=False)
-def get_llm():
-    """Cached LLM instance."""
+def get_http_client() -> httpx.Client:
+    """Keep-alive connection pool shared by every Groq chat model."""
+    return httpx.Client(
+        timeout=httpx.Timeout(60.0, connect=5.0),
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_chat_model(model_name: str = RAG_MODEL, temperature: float = RAG_TEMPERATURE,
+                   max_retries: int = 3):
+    """One ChatGroq per (model, temperature, retries), shared by all sessions."""
     return ChatGroq(
         groq_api_key=get_groq_api_key(),
-        model_name="llama-3.1-8b-instant",
-        temperature=0.2,
-        max_retries=3,
+        model_name=model_name,
+        temperature=temperature,
+        max_retries=max_retries,
+        http_client=get_http_client(),
     )
 
 
-def get_rag_chain(vectorstore):
-    """Creates and returns a RAG chain using the vectorstore."""
-    try:
-        llm       = get_llm()
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
+def get_llm():
+    """Cached LLM instance used by the RAG chain."""
+    return get_chat_model(RAG_MODEL, RAG_TEMPERATURE)
 
-        template = """You are an expert exam assistant. Use the following context to answer accurately.
 
-Context: {context}
+def format_docs(docs):
+    return "\n\n".join(doc.page_content for doc in docs)
 
-Question: {question}
 
-Instructions:
-- Provide accurate, well-structured answers
-- For 1-2 marks: concise, direct answers
-- For 10-12 marks: detailed, structured explanations with headings
-- If information is not in the context, say so clearly
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
 
-Answer:"""
+    def count_tokens(text: str) -> int:
+        return len(_encoding.encode(text))
+except Exception:
+    def count_tokens(text: str) -> int:
+        """Rough token count (about 4 characters per token) when tiktoken is missing."""
+        return (len(text) + 3) // 4
 
-        prompt = ChatPromptTemplate.from_template(template)
 
-        def format_docs(docs):
-            return "\n\n".join(doc.page_content for doc in docs)
+def question_marks(question: str):
+    """Marks that format_question recorded in a question, if any."""
+    m = re.search(r"\n\nMarks: (\d+)", question)
+    return int(m.group(1)) if m else None
 
-        chain = (
-            {"context": retriever | format_docs, "question": RunnablePassthrough()}
-            | prompt
-            | llm
-            | StrOutputParser()
-        )
-        return chain
 
+def _join_overlapping(a: str, b: str) -> str:
+    """Concatenate neighbouring chunks, dropping the text the splitter repeated."""
+    for n in range(min(MERGE_OVERLAP, len(a), len(b)), 20, -1):
+        if a.endswith(b[:n]):
+            return a + b[n:]
+    return a + "\n" + b
+
+
+def merge_chunks(docs) -> list:
+    """Join retrieved chunks that are neighbours in the same document, keeping rank order."""
+    passages = []   # [first rank, doc_id, first chunk, last chunk, text]
+    for rank, doc in enumerate(docs):
+        doc_id, n = doc.metadata.get("doc_id"), doc.metadata.get("chunk")
+        passages.append([rank, doc_id, n, n, doc.page_content])
+    if any(p[1] is None or p[2] is None for p in passages):
+        return [p[4] for p in passages]
+
+    passages.sort(key=lambda p: (p[1], p[2]))
+    merged = []
+    for p in passages:
+        last = merged[-1] if merged else None
+        if last and last[1] == p[1] and p[2] == last[3] + 1:
+            last[0] = min(last[0], p[0])
+            last[3] = p[3]
+            last[4] = _join_overlapping(last[4], p[4])
+        else:
+            merged.append(p)
+    merged.sort(key=lambda p: p[0])
+    return [p[4] for p in merged]
+
+
+def build_context(docs, budget: int) -> str:
+    """Merged passages in relevance order, cut off at a token budget."""
+    parts, used = [], 0
+    for text in merge_chunks(docs):
+        tokens = count_tokens(text)
+        if used + tokens > budget:
+            if not parts:
+                # Always send something: trim the best passage to fit
+                parts.append(text[: budget * 4])
+            break
+        parts.append(text)
+        used += tokens
+    return "\n\n".join(parts)
+
+
+def _log_prompt_tokens(prompt_value, marks):
+    text = prompt_value.to_string()
+    logger.info(f"RAG prompt: {count_tokens(text)} tokens (marks={marks})")
+    return prompt_value
+
+
+def retrieval_query(question: str) -> str:
+    """The question without the marks guidance appended by format_question."""
+    return question.split("\n\nMarks:", 1)[0]
+
+
+def _build_rag_chain(vectorstore, model_name: str, temperature: float, marks, filters):
+    k, budget = CONTEXT_PROFILES.get(marks, DEFAULT_PROFILE)
+    # The retriever holds the index weakly so the registry entry cannot keep it alive
+    ref = weakref.ref(vectorstore)
+
+    def retrieve_docs(question):
+        vs = ref()
+        return retrieve(vs, retrieval_query(question), k=k, filters=filters) if vs is not None else []
+
+    return (
+        {"context": RunnableLambda(retrieve_docs) | (lambda docs: build_context(docs, budget)),
+         "question": RunnablePassthrough()}
+        | RAG_PROMPT
+        | RunnableLambda(lambda prompt: _log_prompt_tokens(prompt, marks))
+        | get_chat_model(model_name, temperature)
+        | StrOutputParser()
+    )
+
+
+def get_rag_chain(vectorstore, marks=None, filters=None, model_name: str = RAG_MODEL,
+                  temperature: float = RAG_TEMPERATURE):
+    """RAG chain for a vectorstore and question marks, built once and reused while the index is loaded.
+
+    marks (1, 2, 5, 10 or 12) picks how many chunks are retrieved and the
+    token budget for the context; None uses the default profile. filters
+    ({"doc_id", "unit", "pages"}) scopes retrieval to part of the index.
+    """
+    key = (model_name, temperature, marks, freeze_filters(filters))
+    with _chains_lock:
+        chain = _chains.get(vectorstore, {}).get(key)
+    if chain is not None:
+        return chain
+    try:
+        chain = _build_rag_chain(vectorstore, model_name, temperature, marks, dict(filters or {}))
     except Exception as e:
         st.error(f"Error creating RAG chain: {str(e)}")
         return None
+    with _chains_lock:
+        return _chains.setdefault(vectorstore, {}).setdefault(key, chain)
+
+
+def stream_with_timing(chunks, metrics=None):
+    """Yield text pieces from a LangChain stream, recording latency in metrics.
+
+    metrics["ttft"] is the time to the first non-empty token and
+    metrics["total"] the time until the stream finished, both in seconds.
+    """
+    metrics = {} if metrics is None else metrics
+    start = time.perf_counter()
+    for chunk in chunks:
+        text = getattr(chunk, "content", chunk)
+        if not text:
+            continue
+        if "ttft" not in metrics:
+            metrics["ttft"] = time.perf_counter() - start
+        yield text
+    metrics["total"] = time.perf_counter() - start
+    metrics.setdefault("ttft", metrics["total"])
+    logger.info(f"Answer streamed: first token {metrics['ttft']:.2f}s, total {metrics['total']:.2f}s")
+
+
+def stream_rag_answer(vectorstore, question, metrics=None, marks=None, filters=None):
+    """Stream a RAG answer token by token; marks default to those in the formatted question."""
+    chain = get_rag_chain(vectorstore, marks if marks is not None else question_marks(question), filters)
+    return stream_with_timing(chain.stream(question), metrics)
@@ -0,0 +1,423 @@
+"""
+Hybrid retrieval: BM25 over chunk text fused with FAISS dense search.
+Each index carries a sparse inverted index over the same chunk ids. It is
+saved next to index.faiss and kept in step with merges and deletes. Dense and
+sparse rankings are combined with reciprocal-rank fusion, which catches exact
+course codes, acronyms and formula names that embeddings tend to blur.
+An optional cross-encoder then reorders the fused candidates within a
+latency budget. Searches can be scoped by document, unit and page range;
+the scope is applied inside both searches, never to their results.
+"""
+import os
+import re
+import json
+import math
+import time
+import heapq
+import logging
+import weakref
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from index_factory import index_vectors, search_parameters
+
+logger = logging.getLogger(__name__)
+
+SPARSE_FILE = "sparse.json"
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")   # "hybrid" or "dense"
+FETCH_K = 20     # candidates taken from each ranking before fusion
+RRF_K = 60       # standard reciprocal-rank-fusion damping constant
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Cross-encoder reranking; off unless a model is configured
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "")   # e.g. cross-encoder/ms-marco-MiniLM-L-6-v2
+RERANK_FETCH_K = 20
+RERANK_BATCH = 8
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "300"))
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from how in is it its of on or that the this to "
+    "was what when where which who why with explain define describe discuss".split()
+)
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased alphanumeric terms; course codes like CS3401 stay whole."""
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+class SparseIndex:
+    """BM25 inverted index keyed by docstore chunk id."""
+
+    def __init__(self, chunks: Optional[Dict[str, Dict[str, int]]] = None):
+        self.chunks: Dict[str, Counter] = {}
+        self.lengths: Dict[str, int] = {}
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self.total_length = 0
+        self.lock = threading.Lock()
+        for chunk_id, terms in (chunks or {}).items():
+            self._add_terms(chunk_id, Counter(terms))
+
+    def _add_terms(self, chunk_id: str, terms: Counter):
+        self.chunks[chunk_id] = terms
+        self.lengths[chunk_id] = sum(terms.values())
+        self.total_length += self.lengths[chunk_id]
+        for term, tf in terms.items():
+            self.postings[term][chunk_id] = tf
+
+    def add(self, chunk_id: str, text: str):
+        if chunk_id not in self.chunks:
+            self._add_terms(chunk_id, Counter(tokenize(text)))
+
+    def remove(self, chunk_id: str):
+        terms = self.chunks.pop(chunk_id, None)
+        if terms is None:
+            return
+        self.total_length -= self.lengths.pop(chunk_id)
+        for term in terms:
+            posting = self.postings[term]
+            posting.pop(chunk_id, None)
+            if not posting:
+                del self.postings[term]
+
+    def sync(self, vectorstore):
+        """Add and drop chunks so the index matches the vectorstore's docstore."""
+        ids = set(vectorstore.index_to_docstore_id.values())
+        for chunk_id in self.chunks.keys() - ids:
+            self.remove(chunk_id)
+        for chunk_id in ids - self.chunks.keys():
+            doc = vectorstore.docstore.search(chunk_id)
+            self.add(chunk_id, getattr(doc, "page_content", ""))
+
+    def search(self, query: str, k: int = FETCH_K, allowed: Optional[set] = None) -> List[Tuple[str, float]]:
+        """Top-k (chunk_id, BM25 score) pairs for a query, optionally only among allowed ids."""
+        n = len(self.chunks)
+        if not n:
+            return []
+        avg_len = self.total_length / n or 1.0
+        scores: Dict[str, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            df = len(posting)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for chunk_id, tf in posting.items():
+                if allowed is not None and chunk_id not in allowed:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[chunk_id] / avg_len)
+                scores[chunk_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def to_dict(self) -> dict:
+        return {"format": 1, "chunks": {cid: dict(terms) for cid, terms in self.chunks.items()}}
+
+
+# vectorstore -> SparseIndex; entries go away with the index
+_sparse: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_sparse_lock = threading.Lock()
+
+
+def get_sparse_index(vectorstore) -> SparseIndex:
+    """Sparse index for a vectorstore; built from its chunks only the first time.
+
+    After that it is kept current by update_sparse_index, not per query.
+    """
+    with _sparse_lock:
+        sparse = _sparse.get(vectorstore)
+        if sparse is not None:
+            return sparse
+        sparse = _sparse[vectorstore] = SparseIndex()
+        sparse.lock.acquire()
+    try:
+        sparse.sync(vectorstore)
+    finally:
+        sparse.lock.release()
+    return sparse
+
+
+def update_sparse_index(vectorstore, added=(), removed=()):
+    """Apply added (chunk_id, text) pairs and removed chunk ids to a vectorstore's sparse index.
+
+    Does nothing if none is loaded yet: it is then built in full on first use.
+    """
+    with _sparse_lock:
+        sparse = _sparse.get(vectorstore)
+    if sparse is None:
+        return
+    with sparse.lock:
+        for chunk_id in removed:
+            sparse.remove(chunk_id)
+        for chunk_id, text in added:
+            sparse.add(chunk_id, text)
+
+
+def save_sparse_index(vectorstore, path: str):
+    """Write the vectorstore's sparse index into an index directory."""
+    sparse = get_sparse_index(vectorstore)
+    with sparse.lock:
+        data = sparse.to_dict()
+    with open(os.path.join(path, SPARSE_FILE), "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+
+
+def load_sparse_index(vectorstore, path: str):
+    """Attach the sparse index saved in path, if any; missing ones are rebuilt on first use."""
+    file = os.path.join(path, SPARSE_FILE)
+    if not os.path.exists(file):
+        return
+    try:
+        with open(file, "r", encoding="utf-8") as f:
+            sparse = SparseIndex(json.load(f).get("chunks"))
+    except (OSError, ValueError):
+        return
+    with _sparse_lock:
+        _sparse[vectorstore] = sparse
+
+
+def freeze_filters(filters: Optional[dict]) -> tuple:
+    """Hashable form of a filter dict, for use in cache keys."""
+    if not filters:
+        return ()
+    return tuple(sorted(
+        (key, tuple(sorted(value)) if isinstance(value, (set, list)) else value)
+        for key, value in filters.items() if value not in (None, "", ())
+    ))
+
+
+def chunk_metadata(vectorstore) -> Dict[str, dict]:
+    """Metadata of every chunk by id, in one pass when the docstore supports it."""
+    iter_metadata = getattr(vectorstore.docstore, "iter_metadata", None)
+    if iter_metadata is not None:
+        return dict(iter_metadata())
+    return {cid: getattr(vectorstore.docstore.search(cid), "metadata", {})
+            for cid in vectorstore.index_to_docstore_id.values()}
+
+
+def _doc_id(chunk_id: str) -> str:
+    return chunk_id.rsplit("-", 1)[0]
+
+
+class ChunkCatalog:
+    """Filterable fields of an index's chunks, so filtered searches do not read the chunk store per query.
+
+    Positions by document come from the chunk ids alone and are rebuilt only
+    after the index changes; unit and page fields are read from the chunk
+    store once, the first time a unit or page filter is used.
+    """
+
+    def __init__(self):
+        self.positions: Dict[str, List[Tuple[int, str]]] = {}   # doc id -> [(position, chunk id)]
+        self.size = -1                                          # index size positions were built for
+        self.fields: Optional[Dict[str, tuple]] = None          # chunk id -> (unit, page, page_end)
+        self.lock = threading.Lock()
+
+    def by_document(self, vectorstore) -> Dict[str, List[Tuple[int, str]]]:
+        mapping = vectorstore.index_to_docstore_id
+        if self.size != len(mapping):
+            positions = defaultdict(list)
+            for position, chunk_id in mapping.items():
+                positions[_doc_id(chunk_id)].append((position, chunk_id))
+            self.positions, self.size = dict(positions), len(mapping)
+        return self.positions
+
+    def chunk_fields(self, vectorstore) -> Dict[str, tuple]:
+        if self.fields is None:
+            live = set(vectorstore.index_to_docstore_id.values())
+            self.fields = {cid: _fields(m) for cid, m in chunk_metadata(vectorstore).items() if cid in live}
+        return self.fields
+
+
+def _fields(metadata: dict) -> tuple:
+    page = metadata.get("page")
+    return metadata.get("unit", ""), page, metadata.get("page_end", page)
+
+
+# vectorstore -> ChunkCatalog; entries go away with the index
+_catalogs: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def get_chunk_catalog(vectorstore) -> ChunkCatalog:
+    with _sparse_lock:
+        catalog = _catalogs.get(vectorstore)
+        if catalog is None:
+            catalog = _catalogs[vectorstore] = ChunkCatalog()
+        return catalog
+
+
+def update_chunk_catalog(vectorstore, added=(), removed=()):
+    """Apply added (chunk_id, metadata) pairs and removed chunk ids to a vectorstore's catalog.
+
+    Positions are rebuilt from the chunk ids on next use, since deletes renumber them.
+    """
+    with _sparse_lock:
+        catalog = _catalogs.get(vectorstore)
+    if catalog is None:
+        return
+    with catalog.lock:
+        catalog.size = -1
+        if catalog.fields is not None:
+            for chunk_id in removed:
+                catalog.fields.pop(chunk_id, None)
+            for chunk_id, metadata in added:
+                catalog.fields[chunk_id] = _fields(metadata)
+
+
+def _fields_match(fields: tuple, filters: dict) -> bool:
+    unit, first, last = fields
+    if filters.get("unit") and unit != filters["unit"]:
+        return False
+    pages = filters.get("pages")
+    if pages and (first is None or last < pages[0] or first > pages[1]):
+        return False
+    return True
+
+
+def filter_positions(vectorstore, filters: dict) -> Tuple[np.ndarray, set]:
+    """FAISS positions and chunk ids of the chunks a filter allows.
+
+    filters may hold "doc_id" (one id or several), "unit" and "pages"
+    (an inclusive (first, last) range).
+    """
+    catalog = get_chunk_catalog(vectorstore)
+    with catalog.lock:
+        by_document = catalog.by_document(vectorstore)
+        doc_ids = filters.get("doc_id")
+        if doc_ids:
+            doc_ids = [doc_ids] if isinstance(doc_ids, str) else doc_ids
+            candidates = [c for doc_id in doc_ids for c in by_document.get(doc_id, ())]
+        else:
+            candidates = [c for chunks in by_document.values() for c in chunks]
+        if filters.get("unit") or filters.get("pages"):
+            fields = catalog.chunk_fields(vectorstore)
+            candidates = [(p, cid) for p, cid in candidates
+                          if _fields_match(fields.get(cid, ("", None, None)), filters)]
+    positions = np.asarray(sorted(p for p, _ in candidates), dtype="int64")
+    return positions, {cid for _, cid in candidates}
+
+
+def document_units(vectorstore, doc_id: Optional[str] = None) -> List[str]:
+    """Unit titles present in an index, optionally for one document."""
+    catalog = get_chunk_catalog(vectorstore)
+    with catalog.lock:
+        fields = catalog.chunk_fields(vectorstore)
+        if doc_id:
+            chunk_ids = [cid for _, cid in catalog.by_document(vectorstore).get(doc_id, ())]
+        else:
+            chunk_ids = list(fields)
+        units = {fields[cid][0] for cid in chunk_ids if cid in fields}
+    return sorted(u for u in units if u)
+
+
+def _search_index(index, vector: np.ndarray, k: int, positions: Optional[np.ndarray] = None):
+    """index.search, restricted to positions with an ID selector when given."""
+    if positions is None:
+        return index.search(vector, k)
+    import faiss
+    try:
+        selector = faiss.IDSelectorBatch(positions.size, faiss.swig_ptr(positions))
+        return index.search(vector, k, params=search_parameters(index, selector))
+    except (AttributeError, RuntimeError, TypeError):
+        # Index type without selector support: exact scan over just the allowed vectors
+        allowed = index_vectors(index, positions)
+        distances = ((allowed - vector) ** 2).sum(axis=1)
+        top = np.argsort(distances)[:k]
+        return distances[top][None, :], positions[top][None, :]
+
+
+def dense_search(vectorstore, query: str, k: int = FETCH_K,
+                 positions: Optional[np.ndarray] = None) -> List[str]:
+    """Chunk ids of the k nearest vectors, best first, optionally among positions only."""
+    limit = vectorstore.index.ntotal if positions is None else positions.size
+    vector = np.asarray([vectorstore.embeddings.embed_query(query)], dtype="float32")
+    _, found = _search_index(vectorstore.index, vector, min(k, limit), positions)
+    return [vectorstore.index_to_docstore_id[p] for p in found[0] if p != -1]
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], rrf_k: int = RRF_K) -> List[str]:
+    """Merge ranked id lists; ids ranked high in any list come first."""
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] += 1.0 / (rrf_k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def hybrid_search(vectorstore, query: str, k: int = 3, fetch_k: int = FETCH_K,
+                  filters: Optional[dict] = None):
+    """Top-k chunk Documents by fused dense and BM25 rank, within the filtered chunks."""
+    if vectorstore.index.ntotal == 0:
+        return []
+    positions = allowed = None
+    if filters:
+        positions, allowed = filter_positions(vectorstore, filters)
+        if not allowed:
+            return []
+    if RETRIEVAL_MODE == "dense":
+        found = dense_search(vectorstore, query, k, positions)
+        return [vectorstore.docstore.search(cid) for cid in found]
+    dense = dense_search(vectorstore, query, fetch_k, positions)
+    index = get_sparse_index(vectorstore)
+    with index.lock:
+        sparse = [cid for cid, _ in index.search(query, fetch_k, allowed)]
+    fused = reciprocal_rank_fusion([dense, sparse])[:k]
+    return [vectorstore.docstore.search(cid) for cid in fused]
+
+
+_reranker = None
+_reranker_failed = False
+_reranker_lock = threading.Lock()
+
+
+def get_reranker():
+    """The configured CrossEncoder, loaded once; None when disabled or unavailable."""
+    global _reranker, _reranker_failed
+    if not RERANKER_MODEL or _reranker_failed:
+        return None
+    with _reranker_lock:
+        if _reranker is None and not _reranker_failed:
+            try:
+                from sentence_transformers import CrossEncoder
+                _reranker = CrossEncoder(RERANKER_MODEL, device="cpu")
+            except Exception as e:
+                logger.warning(f"Reranker '{RERANKER_MODEL}' unavailable, using fused order: {e}")
+                _reranker_failed = True
+        return _reranker
+
+
+def rerank(query: str, docs: list, k: int, budget_ms: float = RERANK_BUDGET_MS) -> list:
+    """Best k docs by cross-encoder score, scored in batches until the budget runs out.
+
+    Candidates that could not be scored in time keep their incoming order
+    behind the scored ones, so an exhausted budget degrades to that order.
+    """
+    model = get_reranker()
+    if model is None or len(docs) <= 1:
+        return docs[:k]
+    start = time.perf_counter()
+    deadline = start + budget_ms / 1000
+    scores, batch_seconds = [], 0.0
+    for i in range(0, len(docs), RERANK_BATCH):
+        now = time.perf_counter()
+        if i and now + batch_seconds > deadline:
+            break
+        batch = docs[i:i + RERANK_BATCH]
+        scores.extend(model.predict([(query, d.page_content) for d in batch]))
+        batch_seconds = time.perf_counter() - now
+    scored = len(scores)
+    order = sorted(range(scored), key=lambda j: -float(scores[j]))
+    elapsed = (time.perf_counter() - start) * 1000
+    if scored < len(docs):
+        logger.info(f"Rerank budget reached after {scored}/{len(docs)} candidates ({elapsed:.0f}ms)")
+    return ([docs[j] for j in order] + docs[scored:])[:k]
+
+
+def retrieve(vectorstore, query: str, k: int = 3, filters: Optional[dict] = None) -> list:
+    """Hybrid search, over-fetched and reranked when a cross-encoder is configured."""
+    if get_reranker() is None:
+        return hybrid_search(vectorstore, query, k=k, filters=filters)
+    candidates = hybrid_search(vectorstore, query, k=max(k, RERANK_FETCH_K), filters=filters)
+    return rerank(query, candidates, k)
@@ -30,6 +30,11 @@ if not exist ".env" (
     exit /b 1
 )
 
+REM Build the default index now rather than in the first user's session
+echo Building default index...
+python build_index.py
+echo.
+
 REM Run the app
 echo Starting Streamlit app...
 echo.
@@ -6,6 +6,7 @@ echo.
 echo Starting the advanced version...
 echo.
 
+python build_index.py
 streamlit run app_advanced.py
 
 pause
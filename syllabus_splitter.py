@@ -0,0 +1,156 @@
+"""
+Structure-aware splitter for syllabus and course documents.
+Lines such as "UNIT II: Process Management", "Module 3" or "2.1 Paging"
+start a new section; sections are chunked whole where they fit, small ones
+under the same unit are packed together, and long ones are cut at line
+breaks once they reach the chunk size, so text without headings still
+streams page by page. Only single overlong lines fall back to character
+splitting. Every chunk carries its page range, unit and section title so
+retrieval can filter and cite them.
+"""
+import re
+from bisect import bisect_right
+from typing import Iterable, Iterator, List, Optional, Tuple
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+MAX_HEADING_LEN = 120
+MAX_TOPIC_WORDS = 10   # "2.1 Paging and Segmentation", not a numbered sentence
+MAX_CAPS_WORDS = 6
+# Numbered or all-caps lines starting with these are questions or instructions, not headings
+INSTRUCTION_WORDS = frozenset(
+    "answer attempt briefly compare define derive describe differentiate discuss distinguish "
+    "draw evaluate explain find give how illustrate justify list note state what when where "
+    "which why write".split()
+)
+
+UNIT_RE = re.compile(
+    r"^(unit|module|chapter|part)\s*[-–:.]?\s*([ivxlc]+|\d{1,2})\b\s*[-–:.]?\s*(.*)$", re.I
+)
+TOPIC_RE = re.compile(r"^(\d{1,2}(?:\.\d{1,2}){0,3})[.)]?\s+([A-Z][^.!?]{2,100})$")
+CAPS_RE = re.compile(r"^[A-Z][A-Z0-9 &/,()'-]{3,80}$")
+
+
+def classify_heading(line: str) -> Tuple[Optional[str], Optional[str]]:
+    """("unit" | "section", title) for a heading line, else (None, None)."""
+    line = line.strip()
+    if not line or len(line) > MAX_HEADING_LEN:
+        return None, None
+    m = UNIT_RE.match(line)
+    if m:
+        word, number, rest = m.groups()
+        title = f"{word.title()} {number.upper()}"
+        rest = rest.strip(" -–:.")
+        return "unit", f"{title}: {rest}" if rest else title
+    m = TOPIC_RE.match(line)
+    if m:
+        words = m.group(2).split()
+        if len(words) <= MAX_TOPIC_WORDS and words[0].lower() not in INSTRUCTION_WORDS:
+            return "section", f"{m.group(1)} {m.group(2).strip()}"
+        return None, None
+    if CAPS_RE.match(line) and sum(c.isalpha() for c in line) >= 4:
+        words = re.findall(r"[A-Za-z]+", line)
+        if len(line.split()) <= MAX_CAPS_WORDS and words[0].lower() not in INSTRUCTION_WORDS:
+            return "section", line.title()
+    return None, None
+
+
+class SyllabusSplitter:
+    """Split a stream of (page_number, text) pages into heading-aligned chunks."""
+
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 50):
+        self.chunk_size = chunk_size
+        self._fallback = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=len,
+            separators=["\n\n", "\n", " ", ""],
+        )
+
+    def _blocks(self, pages: Iterable[Tuple[int, str]]) -> Iterator[dict]:
+        """Sections as {text, page, page_end, unit, section, breaks}, in document order.
+
+        breaks lists (character offset, page number) wherever the page changes.
+        A section is cut at a line break once it reaches chunk_size, so at most
+        one chunk's worth of text is held however far away the next heading is.
+        """
+        unit = section = None
+        lines: List[Tuple[int, str]] = []
+        size = 0
+        has_body = False   # a run of bare headings is kept as the next section's preamble
+
+        def block():
+            text, breaks, offset = [], [], 0
+            for page_no, line in lines:
+                if not breaks or breaks[-1][1] != page_no:
+                    breaks.append((offset, page_no))
+                text.append(line)
+                offset += len(line) + 1
+            return {"text": "\n".join(text), "page": breaks[0][1], "page_end": breaks[-1][1],
+                    "unit": unit, "section": section, "breaks": breaks}
+
+        for page_no, text in pages:
+            for line in text.splitlines():
+                kind, title = classify_heading(line)
+                if kind:
+                    if has_body:
+                        yield block()
+                        lines, size, has_body = [], 0, False
+                    if kind == "unit":
+                        unit, section = title, None
+                    else:
+                        section = title
+                elif line.strip():
+                    if has_body and size + len(line) + 1 > self.chunk_size:
+                        # Long section: emit what fits; the rest continues under the same title
+                        yield block()
+                        lines, size = [], 0
+                    has_body = True
+                lines.append((page_no, line))
+                size += len(line) + 1
+        if any(l.strip() for _, l in lines):
+            yield block()
+
+    @staticmethod
+    def _page_at(block: dict, offset: int) -> int:
+        breaks = block["breaks"]
+        return breaks[bisect_right([o for o, _ in breaks], offset) - 1][1]
+
+    def _document(self, block: dict) -> Document:
+        return Document(page_content=block["text"].strip(), metadata={
+            "page": block["page"],
+            "page_end": block["page_end"],
+            "unit": block["unit"] or "",
+            "section": "; ".join(block.get("section_list", [])) or block["section"] or "",
+        })
+
+    def split_pages(self, pages: Iterable[Tuple[int, str]]) -> Iterator[Document]:
+        """Chunk Documents for a page stream; pages are consumed lazily."""
+        pending = None
+        for block in self._blocks(pages):
+            if (pending and pending["unit"] == block["unit"]
+                    and len(pending["text"]) + len(block["text"]) + 2 <= self.chunk_size):
+                # Pack short topics of the same unit into one chunk
+                pending["text"] += "\n\n" + block["text"]
+                pending["page_end"] = block["page_end"]
+                if block["section"] and block["section"] not in pending["section_list"]:
+                    pending["section_list"].append(block["section"])
+                continue
+            if pending:
+                yield self._document(pending)
+                pending = None
+            if len(block["text"]) <= self.chunk_size:
+                pending = {**block, "section_list": [block["section"]] if block["section"] else []}
+                continue
+            cursor = 0
+            for piece in self._fallback.split_text(block["text"]):
+                at = block["text"].find(piece, cursor)
+                at = cursor if at < 0 else at
+                cursor = at + 1
+                yield self._document({**block, "text": piece, "page": self._page_at(block, at),
+                                      "page_end": self._page_at(block, at + len(piece) - 1)})
+        if pending:
+            yield self._document(pending)
+
+    def split_text(self, text: str) -> List[str]:
+        return [d.page_content for d in self.split_pages([(1, text)])]
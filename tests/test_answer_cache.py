@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from answer_cache import SemanticAnswerCache
+
+
+def unit(*values):
+    v = np.asarray(values, dtype="float32")
+    return v / np.linalg.norm(v)
+
+
+def test_similar_question_hits():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.store("idx", 5, "What is paging?", unit(1, 0, 0), "answer")
+    assert cache.lookup("idx", 5, unit(1, 0.1, 0)) == "answer"
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_dissimilar_question_misses():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.store("idx", 5, "What is paging?", unit(1, 0, 0), "answer")
+    assert cache.lookup("idx", 5, unit(0, 1, 0)) is None
+    assert cache.misses == 1
+
+
+@pytest.mark.parametrize("index_id, marks", [("other", 5), ("idx", 10), ("idx", None)])
+def test_groups_are_separate_per_index_and_marks(index_id, marks):
+    cache = SemanticAnswerCache()
+    cache.store("idx", 5, "q", unit(1, 0), "answer")
+    assert cache.lookup(index_id, marks, unit(1, 0)) is None
+
+
+def test_expired_answers_are_not_served(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("answer_cache.time.time", lambda: now[0])
+    cache = SemanticAnswerCache(ttl=60)
+    cache.store("idx", None, "q", unit(1, 0), "answer")
+    now[0] += 61
+    assert cache.lookup("idx", None, unit(1, 0)) is None
+
+
+def test_least_recently_used_answer_is_dropped(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("answer_cache.time.time", lambda: now[0])
+    cache = SemanticAnswerCache(max_entries=2)
+    for i, vector in enumerate([unit(1, 0, 0), unit(0, 1, 0)]):
+        now[0] += 1
+        cache.store("idx", None, f"q{i}", vector, f"a{i}")
+    now[0] += 1
+    assert cache.lookup("idx", None, unit(1, 0, 0)) == "a0"   # a1 is now the least recent
+    now[0] += 1
+    cache.store("idx", None, "q2", unit(0, 0, 1), "a2")
+    assert cache.lookup("idx", None, unit(0, 1, 0)) is None
+    assert cache.lookup("idx", None, unit(1, 0, 0)) == "a0"
+    assert cache.lookup("idx", None, unit(0, 0, 1)) == "a2"
+
+
+def test_oldest_group_is_dropped_past_max_groups():
+    cache = SemanticAnswerCache(max_groups=2)
+    for index_id in ("a", "b", "c"):
+        cache.store(index_id, None, "q", unit(1, 0), index_id)
+    assert cache.lookup("a", None, unit(1, 0)) is None
+    assert cache.lookup("c", None, unit(1, 0)) == "c"
+
+
+def test_invalidate_forgets_every_group_of_an_index():
+    cache = SemanticAnswerCache()
+    cache.store("idx", 5, "q", unit(1, 0), "five")
+    cache.store("idx", 10, "q", unit(1, 0), "ten")
+    cache.store("other", 5, "q", unit(1, 0), "kept")
+    cache.invalidate("idx")
+    assert cache.lookup("idx", 5, unit(1, 0)) is None
+    assert cache.lookup("idx", 10, unit(1, 0)) is None
+    assert cache.lookup("other", 5, unit(1, 0)) == "kept"
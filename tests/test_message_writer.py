@@ -0,0 +1,112 @@
+import os
+import json
+import time
+import pytest
+import message_writer
+from message_writer import MessageWriter
+
+
+@pytest.fixture
+def writer_env(tmp_path, monkeypatch):
+    monkeypatch.setattr(message_writer, "get_project_id", lambda: "demo")
+    monkeypatch.setattr(message_writer, "cache_message", lambda session_id, message: None)
+    monkeypatch.setattr(message_writer, "FLUSH_INTERVAL", 0.01)
+    commits = []
+    statuses = []
+
+    def commit(self, batch, token):
+        commits.append((token, [e["message"]["content"] for e in batch]))
+        return statuses.pop(0) if statuses else 200
+
+    monkeypatch.setattr(MessageWriter, "_commit", commit)
+    return tmp_path, commits, statuses
+
+
+def make_writer(tmp_path):
+    return MessageWriter(dead_letter_dir=str(tmp_path / "dead"), spool_dir=str(tmp_path / "spool"))
+
+
+def spool_lines(writer):
+    with open(writer.spool_path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_messages_are_committed_and_spool_emptied(writer_env):
+    tmp_path, commits, _ = writer_env
+    writer = make_writer(tmp_path)
+    writer.enqueue("s1", "user", "hello", "tok", uid="u1")
+    writer.enqueue("s1", "assistant", "hi", "tok", uid="u1")
+    assert writer.flush(5)
+    assert [c for _, batch in commits for c in batch] == ["hello", "hi"]
+    assert spool_lines(writer) == []
+
+
+def test_spool_holds_no_tokens(writer_env, monkeypatch):
+    tmp_path, _, _ = writer_env
+    monkeypatch.setattr(MessageWriter, "_run", lambda self: None)   # nothing is sent
+    writer = make_writer(tmp_path)
+    writer.enqueue("s1", "user", "hello", "secret-token", uid="u1")
+    with open(writer.spool_path, encoding="utf-8") as f:
+        assert "secret-token" not in f.read()
+    assert os.stat(writer.spool_path).st_mode & 0o777 == 0o600
+
+
+def test_dead_process_spool_is_replayed_with_the_owners_next_token(writer_env):
+    tmp_path, commits, _ = writer_env
+    spool = tmp_path / "spool"
+    spool.mkdir()
+    dead = spool / "messages-999999.jsonl"
+    db = "projects/demo/databases/(default)"
+    records = [
+        {"id": "1", "database": db, "owner": "u1", "message": {"sessionId": "s1", "content": "lost"}},
+        {"id": "2", "database": db, "owner": "u1", "message": {"sessionId": "s1", "content": "sent"}},
+        {"done": "2"},
+    ]
+    dead.write_text("".join(json.dumps(r) + "\n" for r in records) + '{"id": "3", "datab')
+    old = time.time() - message_writer.SPOOL_STALE_SECONDS - 10
+    os.utime(dead, (old, old))
+
+    writer = make_writer(tmp_path)
+    assert not dead.exists()
+    assert [m["content"] for m in writer.pending_for("s1")] == ["lost"]
+    writer.enqueue("s1", "user", "new", "fresh", uid="u1")
+    assert writer.flush(5)
+    assert commits == [("fresh", ["lost", "new"])]
+
+
+def test_live_process_spool_is_left_alone(writer_env):
+    tmp_path, _, _ = writer_env
+    spool = tmp_path / "spool"
+    spool.mkdir()
+    live = spool / "messages-999999.jsonl"
+    live.write_text(json.dumps({"id": "1", "database": "db", "owner": "u1",
+                                "message": {"sessionId": "s1", "content": "x"}}) + "\n")
+    writer = make_writer(tmp_path)
+    assert live.exists()
+    assert writer.pending_for("s1") == []
+
+
+def test_expired_token_parks_messages_until_the_next_one(writer_env):
+    tmp_path, commits, statuses = writer_env
+    statuses.append(401)
+    writer = make_writer(tmp_path)
+    writer.enqueue("s1", "user", "first", "old", uid="u1")
+    assert writer.flush(5)
+    assert [m["content"] for m in writer.pending_for("s1")] == ["first"]
+    assert [r.get("id") for r in spool_lines(writer)] == [spool_lines(writer)[0]["id"]]
+    writer.enqueue("s1", "user", "second", "new", uid="u1")
+    assert writer.flush(5)
+    assert commits[-1] == ("new", ["first", "second"])
+    assert writer.pending_for("s1") == []
+
+
+def test_rejected_batch_goes_to_dead_letter(writer_env):
+    tmp_path, _, statuses = writer_env
+    statuses.append(400)
+    writer = make_writer(tmp_path)
+    writer.enqueue("s1", "user", "bad", "tok", uid="u1")
+    assert writer.flush(5)
+    with open(writer.dead_letter_path, encoding="utf-8") as f:
+        (line,) = f.readlines()
+    assert json.loads(line)["message"]["content"] == "bad"
+    assert writer.pending_for("s1") == []
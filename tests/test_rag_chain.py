@@ -0,0 +1,39 @@
+from langchain_core.documents import Document
+from rag_chain import merge_chunks, _join_overlapping
+
+
+def chunk(text, doc_id="d", n=0):
+    return Document(page_content=text, metadata={"doc_id": doc_id, "chunk": n})
+
+
+def test_join_drops_repeated_overlap():
+    overlap = "shared text that the splitter repeated"
+    assert _join_overlapping("first part " + overlap, overlap + " second part") == \
+        "first part " + overlap + " second part"
+
+
+def test_join_without_overlap_uses_a_line_break():
+    assert _join_overlapping("first part.", "second part.") == "first part.\nsecond part."
+
+
+def test_join_ignores_short_accidental_overlap():
+    assert _join_overlapping("ends with the", "the start") == "ends with the\nthe start"
+
+
+def test_neighbours_are_merged():
+    assert merge_chunks([chunk("B", n=1), chunk("A", n=0)]) == ["A\nB"]
+
+
+def test_rank_order_is_kept_by_best_member():
+    docs = [chunk("X", "x", 5), chunk("B", "d", 1), chunk("A", "d", 0), chunk("Y", "y", 0)]
+    assert merge_chunks(docs) == ["X", "A\nB", "Y"]
+
+
+def test_gaps_and_other_documents_are_not_merged():
+    docs = [chunk("A", n=0), chunk("C", n=2), chunk("other", "e", 1)]
+    assert merge_chunks(docs) == ["A", "C", "other"]
+
+
+def test_chunks_without_position_metadata_pass_through():
+    docs = [chunk("A", n=0), Document(page_content="plain"), chunk("B", n=1)]
+    assert merge_chunks(docs) == ["A", "plain", "B"]
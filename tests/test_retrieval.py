@@ -0,0 +1,142 @@
+import pytest
+from retrieval import (
+    SparseIndex, reciprocal_rank_fusion, tokenize, filter_positions, document_units,
+    update_chunk_catalog, get_sparse_index, update_sparse_index,
+)
+
+
+class Doc:
+    def __init__(self, text, metadata):
+        self.page_content = text
+        self.metadata = metadata
+
+
+class Docstore:
+    def __init__(self, docs):
+        self.docs = docs
+        self.metadata_reads = 0
+
+    def search(self, chunk_id):
+        return self.docs[chunk_id]
+
+    def iter_metadata(self):
+        self.metadata_reads += 1
+        for chunk_id, doc in self.docs.items():
+            yield chunk_id, doc.metadata
+
+
+class Vectorstore:
+    def __init__(self, docs):
+        self.docstore = Docstore(docs)
+        self.index_to_docstore_id = dict(enumerate(docs))
+
+
+def make_vectorstore():
+    return Vectorstore({
+        "a-0": Doc("CS3401 algorithms syllabus", {"unit": "Unit I", "page": 1}),
+        "a-1": Doc("paging and segmentation", {"unit": "Unit I", "page": 2, "page_end": 3}),
+        "a-2": Doc("deadlock avoidance", {"unit": "Unit II", "page": 4}),
+        "b-0": Doc("paging in the linux kernel", {"unit": "Unit I", "page": 1}),
+    })
+
+
+def test_tokenize_keeps_course_codes_and_drops_stopwords():
+    assert tokenize("What is CS3401 and the TLB?") == ["cs3401", "tlb"]
+
+
+def test_sparse_search_ranks_exact_term_first():
+    index = SparseIndex()
+    index.add("1", "memory management and virtual memory")
+    index.add("2", "course code CS3401 covers algorithms")
+    index.add("3", "algorithms for scheduling")
+    assert index.search("CS3401")[0][0] == "2"
+    # Same term frequency: the shorter chunk scores higher
+    assert [cid for cid, _ in index.search("algorithms")] == ["3", "2"]
+
+
+def test_sparse_search_within_allowed_ids():
+    index = SparseIndex()
+    index.add("1", "paging")
+    index.add("2", "paging tables")
+    assert [cid for cid, _ in index.search("paging", allowed={"2"})] == ["2"]
+
+
+def test_sparse_remove_clears_postings_and_lengths():
+    index = SparseIndex()
+    index.add("1", "paging tables")
+    index.add("2", "paging")
+    index.remove("1")
+    index.remove("missing")
+    assert "tables" not in index.postings
+    assert index.total_length == 1
+    assert [cid for cid, _ in index.search("paging")] == ["2"]
+
+
+def test_sparse_add_is_idempotent():
+    index = SparseIndex()
+    index.add("1", "paging")
+    index.add("1", "paging")
+    assert index.total_length == 1
+
+
+def test_sparse_round_trip():
+    index = SparseIndex()
+    index.add("1", "paging tables")
+    restored = SparseIndex(index.to_dict()["chunks"])
+    assert restored.search("tables") == index.search("tables")
+
+
+def test_sparse_index_follows_updates():
+    vectorstore = make_vectorstore()
+    sparse = get_sparse_index(vectorstore)
+    assert sparse.chunks.keys() == {"a-0", "a-1", "a-2", "b-0"}
+    update_sparse_index(vectorstore, added=[("c-0", "kernel modules")], removed=["b-0"])
+    assert get_sparse_index(vectorstore) is sparse
+    assert [cid for cid, _ in sparse.search("kernel")] == ["c-0"]
+
+
+def test_rrf_favours_ids_ranked_high_in_both_lists():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "d", "a"]])
+    assert fused[0] == "b"
+    assert fused[1] == "a"
+    assert set(fused) == {"a", "b", "c", "d"}
+
+
+def test_rrf_single_ranking_keeps_order():
+    assert reciprocal_rank_fusion([["x", "y", "z"]]) == ["x", "y", "z"]
+
+
+@pytest.mark.parametrize("filters, expected", [
+    ({"doc_id": "b"}, [3]),
+    ({"doc_id": ["a", "b"], "unit": "Unit I"}, [0, 1, 3]),
+    ({"unit": "Unit II"}, [2]),
+    ({"pages": (3, 4)}, [1, 2]),
+    ({"doc_id": "a", "pages": (1, 1)}, [0]),
+    ({"doc_id": "missing"}, []),
+])
+def test_filter_positions(filters, expected):
+    positions, ids = filter_positions(make_vectorstore(), filters)
+    assert positions.tolist() == expected
+    assert len(ids) == len(expected)
+
+
+def test_document_filter_does_not_read_the_chunk_store():
+    vectorstore = make_vectorstore()
+    filter_positions(vectorstore, {"doc_id": "a"})
+    assert vectorstore.docstore.metadata_reads == 0
+    filter_positions(vectorstore, {"unit": "Unit I"})
+    filter_positions(vectorstore, {"pages": (1, 2)})
+    document_units(vectorstore)
+    assert vectorstore.docstore.metadata_reads == 1
+
+
+def test_catalog_follows_added_and_removed_chunks():
+    vectorstore = make_vectorstore()
+    assert document_units(vectorstore) == ["Unit I", "Unit II"]
+    # What FAISS.delete leaves behind: remaining chunks renumbered from 0
+    vectorstore.index_to_docstore_id = {0: "a-0", 1: "a-1", 2: "b-0", 3: "c-0"}
+    update_chunk_catalog(vectorstore, added=[("c-0", {"unit": "Unit III", "page": 9})], removed=["a-2"])
+    assert document_units(vectorstore) == ["Unit I", "Unit III"]
+    assert document_units(vectorstore, "c") == ["Unit III"]
+    assert filter_positions(vectorstore, {"doc_id": "b"})[0].tolist() == [2]
+    assert filter_positions(vectorstore, {"pages": (9, 9)})[0].tolist() == [3]
@@ -0,0 +1,74 @@
+import pytest
+from syllabus_splitter import SyllabusSplitter, classify_heading
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("UNIT II: Process Management", ("unit", "Unit II: Process Management")),
+    ("Module 3 - Memory", ("unit", "Module 3: Memory")),
+    ("unit iv", ("unit", "Unit IV")),
+    ("2.1 Paging", ("section", "2.1 Paging")),
+    ("1. Introduction to Operating Systems", ("section", "1 Introduction to Operating Systems")),
+    ("PROCESS SCHEDULING", ("section", "Process Scheduling")),
+])
+def test_headings(line, expected):
+    assert classify_heading(line) == expected
+
+
+@pytest.mark.parametrize("line", [
+    "",
+    "Paging divides memory into fixed-size frames.",
+    "1. Explain the working of paging",
+    "3. What is a deadlock?",
+    "2. Paging divides memory into fixed size frames that are mapped by the page table",
+    "ANSWER ALL QUESTIONS",
+    "THE PROCESS IS TERMINATED WHEN THE PARENT EXITS",
+    "Unit " + "x" * 200,
+])
+def test_not_headings(line):
+    assert classify_heading(line) == (None, None)
+
+
+def test_chunks_follow_headings_with_metadata():
+    pages = [
+        (1, "UNIT I: Basics\n1.1 Processes\nA process is a program in execution."),
+        (2, "1.2 Threads\nA thread is a unit of CPU use.\nUNIT II: Memory\n2.1 Paging\nPages map to frames."),
+    ]
+    docs = list(SyllabusSplitter(chunk_size=1000).split_pages(pages))
+    assert [d.metadata["unit"] for d in docs] == ["Unit I: Basics", "Unit II: Memory"]
+    assert docs[0].metadata["section"] == "1.1 Processes; 1.2 Threads"
+    assert (docs[0].metadata["page"], docs[0].metadata["page_end"]) == (1, 2)
+    assert (docs[1].metadata["page"], docs[1].metadata["page_end"]) == (2, 2)
+    assert docs[1].page_content.startswith("UNIT II: Memory")
+
+
+def test_numbered_questions_stay_in_their_section():
+    pages = [(1, "2.1 Paging\nPages map to frames.\n1. Explain the working of paging\n2. What is a TLB?")]
+    docs = list(SyllabusSplitter().split_pages(pages))
+    assert len(docs) == 1
+    assert docs[0].metadata["section"] == "2.1 Paging"
+
+
+def test_text_without_headings_streams_in_chunk_sized_pieces():
+    consumed = []
+
+    def pages():
+        for page_no in range(1, 11):
+            consumed.append(page_no)
+            yield page_no, "\n".join(f"line {i} of page {page_no} with some body text" for i in range(5))
+
+    splitter = SyllabusSplitter(chunk_size=300)
+    stream = splitter.split_pages(pages())
+    first = next(stream)
+    assert len(consumed) < 10
+    docs = [first, *stream]
+    assert all(len(d.page_content) <= 300 for d in docs)
+    assert docs[0].metadata["page"] == 1
+    assert docs[-1].metadata["page_end"] == 10
+
+
+def test_overlong_line_falls_back_to_character_splitting():
+    text = "word " * 500
+    docs = list(SyllabusSplitter(chunk_size=200, chunk_overlap=20).split_pages([(7, text)]))
+    assert len(docs) > 1
+    assert all(len(d.page_content) <= 200 for d in docs)
+    assert all(d.metadata["page"] == 7 for d in docs)
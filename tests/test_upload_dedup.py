@@ -0,0 +1,103 @@
+import os
+import time
+import threading
+import pytest
+import upload_dedup
+from upload_dedup import single_flight
+
+
+@pytest.fixture
+def uploads(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_dedup, "UPLOADS_DIR", str(tmp_path / "uploads"))
+    monkeypatch.setattr(upload_dedup, "document_dir", lambda key: str(tmp_path / "docs" / key))
+    monkeypatch.setattr(upload_dedup, "WAIT_POLL_SECONDS", 0.01)
+    return tmp_path
+
+
+def builder(root, calls, delay=0.0):
+    def work():
+        calls.append(threading.get_ident())
+        time.sleep(delay)
+        path = root / "docs" / "key"
+        path.mkdir(parents=True, exist_ok=True)
+        (path / "index.faiss").write_bytes(b"")
+        return {"doc_key": "key", "pages": 3}
+    return work
+
+
+def test_concurrent_callers_build_once(uploads):
+    calls, results, waited = [], [], []
+    work = builder(uploads, calls, delay=0.2)
+
+    def caller():
+        results.append(single_flight("digest", work, on_wait=lambda: waited.append(1)))
+
+    threads = [threading.Thread(target=caller) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert results == [{"doc_key": "key", "pages": 3}] * 4
+    assert 1 <= len(waited) <= 3   # a late starter may find the record already written
+    assert not os.path.exists(upload_dedup._lock_path("digest"))
+
+
+def test_later_upload_reuses_record(uploads):
+    calls = []
+    single_flight("digest", builder(uploads, calls))
+    assert single_flight("digest", builder(uploads, calls)) == {"doc_key": "key", "pages": 3}
+    assert len(calls) == 1
+
+
+def test_record_without_index_is_rebuilt(uploads):
+    calls = []
+    single_flight("digest", builder(uploads, calls))
+    os.remove(uploads / "docs" / "key" / "index.faiss")
+    single_flight("digest", builder(uploads, calls))
+    assert len(calls) == 2
+
+
+def test_failed_work_releases_the_lock(uploads):
+    def fail():
+        raise ValueError("bad pdf")
+
+    with pytest.raises(ValueError):
+        single_flight("digest", fail)
+    calls = []
+    assert single_flight("digest", builder(uploads, calls))["doc_key"] == "key"
+
+
+def test_stale_lock_is_taken_over(uploads):
+    os.makedirs(upload_dedup.UPLOADS_DIR)
+    lock = upload_dedup._lock_path("digest")
+    assert upload_dedup._try_lock(lock, "dead")
+    old = time.time() - upload_dedup.LOCK_STALE_SECONDS - 10
+    os.utime(lock, (old, old))
+    calls = []
+    assert single_flight("digest", builder(uploads, calls))["doc_key"] == "key"
+    assert len(calls) == 1
+
+
+def test_fresh_lock_moved_aside_by_a_late_waiter_is_restored(uploads, monkeypatch):
+    os.makedirs(upload_dedup.UPLOADS_DIR)
+    lock = upload_dedup._lock_path("digest")
+    assert upload_dedup._try_lock(lock, "holder")
+    # The late waiter checked the previous, stale lock; this one is fresh
+    checks = iter([True])
+    is_stale = upload_dedup._is_stale
+    monkeypatch.setattr(upload_dedup, "_is_stale", lambda path: next(checks, None) or is_stale(path))
+    upload_dedup._break_if_stale(lock)
+    with open(lock) as f:
+        assert f.read().strip() == "holder"
+    assert os.listdir(upload_dedup.UPLOADS_DIR) == ["digest.lock"]
+
+
+def test_release_leaves_a_successors_lock(uploads):
+    os.makedirs(upload_dedup.UPLOADS_DIR)
+    lock = upload_dedup._lock_path("digest")
+    assert upload_dedup._try_lock(lock, "successor")
+    upload_dedup._release(lock, "taken-over")
+    assert os.path.exists(lock)
+    upload_dedup._release(lock, "successor")
+    assert not os.path.exists(lock)
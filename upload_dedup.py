@@ -0,0 +1,149 @@
+"""
+Single-flight indexing of uploaded files, keyed by file content hash.
+When several sessions or worker processes receive the same PDF, the first
+takes an O_EXCL lock file under vectorstore/uploads and builds the document
+index; the others wait for it and reuse the result from
+vectorstore/uploads/<hash>.json. Later uploads of the same file skip
+parsing and embedding altogether. The holder touches its lock while it
+works, so a lock left behind by a crashed process goes stale and is taken
+over.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Callable, Optional
+from vectorstore_utils import VECTORSTORE_DIR, document_dir
+
+logger = logging.getLogger(__name__)
+
+UPLOADS_DIR = os.path.join(VECTORSTORE_DIR, "uploads")
+LOCK_STALE_SECONDS = 120   # a lock not touched for this long belongs to a dead process
+HEARTBEAT_SECONDS = 30
+WAIT_POLL_SECONDS = 0.5
+
+
+def file_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _record_path(digest: str) -> str:
+    return os.path.join(UPLOADS_DIR, f"{digest}.json")
+
+
+def _lock_path(digest: str) -> str:
+    return os.path.join(UPLOADS_DIR, f"{digest}.lock")
+
+
+def read_record(digest: str) -> Optional[dict]:
+    """Result recorded for a file hash, if its document index is still on disk."""
+    try:
+        with open(_record_path(digest), "r", encoding="utf-8") as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not os.path.exists(os.path.join(document_dir(record.get("doc_key", "")), "index.faiss")):
+        return None
+    return record
+
+
+def _write_record(digest: str, record: dict):
+    tmp = f"{_record_path(digest)}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(record, f)
+    os.replace(tmp, _record_path(digest))
+
+
+def _try_lock(path: str, token: str) -> bool:
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, "w") as f:
+        f.write(f"{token}\n")
+    return True
+
+
+def _is_stale(path: str) -> bool:
+    return time.time() - os.path.getmtime(path) > LOCK_STALE_SECONDS
+
+
+def _break_if_stale(path: str):
+    """Remove a stale lock; of several waiters, only the one that moves it aside removes it."""
+    aside = f"{path}.{os.getpid()}.{threading.get_ident()}.stale"
+    try:
+        if not _is_stale(path):
+            return
+        os.rename(path, aside)
+    except OSError:
+        return   # released or taken over meanwhile
+    try:
+        if _is_stale(aside):
+            logger.warning(f"Took over stale upload lock {path}")
+        else:
+            # Another waiter broke it and locked anew between our check and the rename: restore theirs
+            os.link(aside, path)
+    except OSError:
+        pass
+    finally:
+        try:
+            os.remove(aside)
+        except OSError:
+            pass
+
+
+def _release(path: str, token: str):
+    """Remove our lock, unless it was taken over as stale meanwhile."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            ours = f.read().strip() == token
+        if ours:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+def _heartbeat(path: str, done: threading.Event):
+    while not done.wait(HEARTBEAT_SECONDS):
+        try:
+            os.utime(path)
+        except OSError:
+            return
+
+
+def single_flight(digest: str, work: Callable[[], dict], on_wait: Optional[Callable[[], None]] = None) -> dict:
+    """Return the record for digest, running work() only if no one has or is producing it.
+
+    work returns a JSON-serialisable record that must include "doc_key".
+    on_wait is called once if this caller ends up waiting for another one.
+    """
+    os.makedirs(UPLOADS_DIR, exist_ok=True)
+    lock = _lock_path(digest)
+    token = f"{os.getpid()}-{threading.get_ident()}-{time.time()}"
+    waiting = False
+    while True:
+        record = read_record(digest)
+        if record is not None:
+            return record
+        if _try_lock(lock, token):
+            break
+        if not waiting and on_wait:
+            on_wait()
+        waiting = True
+        _break_if_stale(lock)
+        time.sleep(WAIT_POLL_SECONDS)
+
+    done = threading.Event()
+    threading.Thread(target=_heartbeat, args=(lock, done), daemon=True).start()
+    try:
+        # The previous holder may have finished between our check and the lock
+        record = read_record(digest)
+        if record is None:
+            record = work()
+            _write_record(digest, record)
+        return record
+    finally:
+        done.set()
+        _release(lock, token)
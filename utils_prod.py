@@ -1,9 +1,8 @@
-import io
 import os
 import re
 import time
 import streamlit as st
-from PyPDF2 import PdfReader
+from pdf_extract import extract_pdf_text, count_pages, MAX_PDF_PAGES
 from typing import Optional, Tuple
 import logging
 
@@ -15,25 +14,18 @@ logger = logging.getLogger(__name__)
 def parse_pdf_info(file_bytes: bytes, filename: str) -> Tuple[str, int]:
     """Parse PDF and extract text with caching"""
     try:
-        reader = PdfReader(io.BytesIO(file_bytes))
-        pages = len(reader.pages)
+        total = count_pages(file_bytes)
         
-        if pages > 100:  # Limit for performance
-            st.warning(f"⚠️ Large PDF detected ({pages} pages). Processing first 100 pages only.")
-            pages = 100
+        if total > MAX_PDF_PAGES:  # Safety cap
+            st.warning(f"⚠️ Large PDF detected ({total} pages). Processing first {MAX_PDF_PAGES} pages only.")
             
-        text = ""
-        for i, page in enumerate(reader.pages[:pages]):
-            if i >= 100:  # Safety check
-                break
-            page_text = page.extract_text() or ""
-            text += page_text + "\n"
+        text, pages = extract_pdf_text(file_bytes, MAX_PDF_PAGES)
             
-        if not text.strip():
+        if not text:
             raise ValueError("No text could be extracted from the PDF")
             
         logger.info(f"Successfully processed PDF: {filename} ({pages} pages)")
-        return text.strip(), pages
+        return text, pages
         
     except Exception as e:
         logger.error(f"Error processing PDF {filename}: {str(e)}")
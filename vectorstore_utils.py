@@ -1,98 +1,345 @@
 import os
+import re
+import json
+import logging
+import shutil
+import hashlib
+import weakref
+import tempfile
+import importlib.metadata
+import faiss
 import streamlit as st
 from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from syllabus_splitter import SyllabusSplitter
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from embedding_engine import EmbeddingEngine, EMBED_BATCH_SIZE, configure_torch_threads
+from retrieval import save_sparse_index, load_sparse_index, update_sparse_index, update_chunk_catalog
+from chunk_store import (
+    ChunkStore, LEGACY_CHUNKS_FILE, chunk_store_path, append_chunks, compact_chunks,
+    write_ids, read_ids, IDS_FILE,
+)
+from index_factory import INDEX_FACTORY, ensure_index_type, convert_index, index_kind, index_vectors
+
+logger = logging.getLogger(__name__)
 
 # Configuration
 VECTORSTORE_DIR = "vectorstore"
 EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 50   # only used when a single section is longer than CHUNK_SIZE
 
-@st.cache_resource(show_spinner=False)
-def get_embeddings():
-    """Get embeddings model with caching"""
+# Embedding backend: "torch" (full precision), "onnx", or "onnx-int8" (quantized ONNX)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+BACKEND_MODEL_KWARGS = {
+    "torch": {},
+    "onnx": {"backend": "onnx"},
+    "onnx-int8": {"backend": "onnx", "model_kwargs": {"file_name": "onnx/model_quint8_avx2.onnx"}},
+}
+ONNX_MIN_SENTENCE_TRANSFORMERS = (3, 2)   # first release with the backend= argument
+
+# One subdirectory per distinct document, named by its content key
+DOCS_DIR = os.path.join(VECTORSTORE_DIR, "docs")
+
+# Memory-map saved indexes read-only so worker processes share one page-cache copy.
+# Off on Windows, where mapped files cannot be replaced while an index is saved.
+INDEX_MMAP = os.getenv("INDEX_MMAP", "0" if os.name == "nt" else "1") == "1"
+
+# Vectorstore -> index file, for those whose FAISS index is a read-only mapping of it
+_mapped = weakref.WeakKeyDictionary()
+
+def embedding_id(backend=EMBEDDING_BACKEND):
+    """Identifies the vectors a backend produces; torch keeps the bare model name"""
+    return EMBEDDING_MODEL if backend == "torch" else f"{EMBEDDING_MODEL}@{backend}"
+
+def _sentence_transformers_version():
+    try:
+        version = importlib.metadata.version("sentence-transformers")
+    except importlib.metadata.PackageNotFoundError:
+        return ()
+    return tuple(int(p) for p in re.findall(r"\d+", version)[:2])
+
+def load_embedding_model(backend=EMBEDDING_BACKEND):
+    """Uncached embeddings model for the given backend"""
+    if backend not in BACKEND_MODEL_KWARGS:
+        raise ValueError(f"Unknown embedding backend '{backend}'")
+    if backend == "torch":
+        configure_torch_threads()
+    elif _sentence_transformers_version() < ONNX_MIN_SENTENCE_TRANSFORMERS:
+        raise RuntimeError(
+            f"The '{backend}' backend needs sentence-transformers >= "
+            f"{'.'.join(map(str, ONNX_MIN_SENTENCE_TRANSFORMERS))}: "
+            'pip install -U "sentence-transformers[onnx]"'
+        )
     return HuggingFaceEmbeddings(
         model_name=EMBEDDING_MODEL,
-        model_kwargs={'device': 'cpu'},
-        encode_kwargs={'normalize_embeddings': True}
+        model_kwargs={'device': 'cpu', **BACKEND_MODEL_KWARGS[backend]},
+        encode_kwargs={'normalize_embeddings': True, 'batch_size': EMBED_BATCH_SIZE}
     )
 
-def create_vectorstore(text):
-    """Create a new vectorstore from text content"""
+@st.cache_resource(show_spinner=False)
+def get_embeddings():
+    """Get embeddings model with caching; chunk vectors are cached on disk too"""
     try:
-        # Split text into chunks
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
-        )
-        chunks = splitter.split_text(text)
-        
-        if not chunks:
-            raise ValueError("No text chunks created")
-        
-        # Create embeddings
-        embeddings = get_embeddings()
-        
-        # Create vectorstore
-        vectorstore = FAISS.from_texts(chunks, embeddings)
-        
-        # Save vectorstore
-        if not os.path.exists(VECTORSTORE_DIR):
-            os.makedirs(VECTORSTORE_DIR)
-        vectorstore.save_local(VECTORSTORE_DIR)
-        
+        model = load_embedding_model(EMBEDDING_BACKEND)
+    except Exception as e:
+        # ONNX backends need `pip install "sentence-transformers[onnx]"`; refuse to mix vector spaces
+        st.error(f"Could not load '{EMBEDDING_BACKEND}' embedding backend: {str(e)}")
+        st.stop()
+    return CachedEmbeddings(model, EmbeddingCache(), embedding_id(EMBEDDING_BACKEND))
+
+def get_splitter():
+    """Heading-aware splitter used for every indexed document"""
+    return SyllabusSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+def index_settings():
+    """Everything besides the text that changes what an index contains"""
+    return {
+        "embedding_model": embedding_id(),
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "splitter": "syllabus-2",   # bump when chunk boundaries change
+        "format": 2,
+    }
+
+def _iter_pages(content):
+    """Yield (page_number, text) from one string, page strings, or (number, text) pairs"""
+    if isinstance(content, str):
+        yield 1, content
+        return
+    for n, item in enumerate(content, 1):
+        yield item if isinstance(item, tuple) else (n, item)
+
+def _key_hash():
+    h = hashlib.sha256()
+    h.update(json.dumps(index_settings(), sort_keys=True).encode("utf-8"))
+    return h
+
+def _hash_page(h, page):
+    h.update(b"\0")
+    h.update(page.encode("utf-8"))
+
+def document_key(content):
+    """Content key for a document: hash of its text plus index settings"""
+    h = _key_hash()
+    for _, page in _iter_pages(content):
+        _hash_page(h, page)
+    return h.hexdigest()[:32]
+
+def document_dir(key):
+    """Directory holding the cached index for a document key"""
+    return os.path.join(DOCS_DIR, key)
+
+def save_vectorstore(vectorstore, path, overwrite=False):
+    """Save into a temp dir and move it into place so readers never see half an index.
+
+    New chunks are appended to the index's chunk store first; rows that end up
+    unused (a crash, or a lost race) are harmless and dropped by compaction.
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".tmp-", dir=parent)
+    old = None
+    try:
+        append_chunks(chunk_store_path(path), vectorstore)
+        faiss.write_index(vectorstore.index, os.path.join(tmp, "index.faiss"))
+        write_ids(tmp, vectorstore)
+        save_sparse_index(vectorstore, tmp)
+        if overwrite and os.path.exists(path):
+            old = tempfile.mkdtemp(prefix=".old-", dir=parent)
+            os.rmdir(old)
+            os.replace(path, old)
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            # Another process finished the same document first; keep theirs
+            if not os.path.exists(os.path.join(path, "index.faiss")):
+                raise
+        else:
+            compact_chunks(chunk_store_path(path), vectorstore.index_to_docstore_id.values())
+    finally:
+        for leftover in (tmp, old):
+            if leftover and os.path.exists(leftover):
+                shutil.rmtree(leftover, ignore_errors=True)
+
+def build_document(content, progress=None):
+    """Build or load the index for one document; returns (vectorstore, key)"""
+    # Content already in memory can be checked against the saved indexes up front
+    if isinstance(content, (str, list, tuple)):
+        key = document_key(content)
+        cached = load_vectorstore(document_dir(key))
+        if cached is not None:
+            return cached, key
+
+    splitter = get_splitter()
+    h = _key_hash()
+
+    def hashed_pages():
+        # Hash pages for the content key as they stream past the splitter
+        for page_no, page in _iter_pages(content):
+            _hash_page(h, page)
+            yield page_no, page
+
+    def chunk_stream():
+        # Chunks carry page, page_end, unit and section metadata
+        yield from splitter.split_pages(hashed_pages())
+
+    # Chunking runs ahead of the encoder; already-seen chunks come from the embedding cache
+    embeddings = get_embeddings()
+    chunks, vectors = EmbeddingEngine(embeddings, progress=progress).embed_stream(chunk_stream())
+    key = h.hexdigest()[:32]
+    path = document_dir(key)
+
+    # A streamed document turned out to be indexed already: reuse the saved index
+    cached = load_vectorstore(path)
+    if cached is not None:
+        return cached, key
+
+    if not chunks:
+        raise ValueError("No text chunks created")
+
+    # Create vectorstore; chunk ids are "<doc key>-<n>" so a document can be removed later
+    vectorstore = FAISS.from_embeddings(
+        list(zip([c.page_content for c in chunks], vectors)),
+        embeddings,
+        metadatas=[{**c.metadata, "doc_id": key, "chunk": i} for i, c in enumerate(chunks)],
+        ids=[f"{key}-{i}" for i in range(len(chunks))],
+    )
+
+    # Save vectorstore (dense and sparse index) under its content key
+    save_vectorstore(vectorstore, path)
+
+    return vectorstore, key
+
+def create_vectorstore(text, factory=INDEX_FACTORY):
+    """Create a vectorstore from text or streamed pages, reusing the cached index for identical content.
+
+    factory is "auto" (Flat, HNSW or IVF-PQ by chunk count) or a faiss index_factory string.
+    """
+    try:
+        vectorstore, key = build_document(text)
+        if ensure_index_type(vectorstore, factory):
+            save_vectorstore(vectorstore, document_dir(key), overwrite=True)
         return vectorstore
-        
+
     except Exception as e:
         st.error(f"Error creating vectorstore: {str(e)}")
         return None
 
-def load_vectorstore():
-    """Load existing vectorstore"""
+def _read_index(index_file):
+    """Read a FAISS index, memory-mapped read-only when possible; returns (index, mapped)"""
+    if INDEX_MMAP:
+        # IO_FLAG_MMAP_IFC maps flat codes, HNSW storage and IVF lists alike. IO_FLAG_MMAP is
+        # left out: IVF rejects it combined with IO_FLAG_MMAP_IFC, and its on-disk lists cannot be copied.
+        try:
+            return faiss.read_index(index_file, faiss.IO_FLAG_READ_ONLY | faiss.IO_FLAG_MMAP_IFC), True
+        except RuntimeError as e:
+            logger.warning(f"Reading {index_file} into memory, memory-mapping failed: {e}")
+    return faiss.read_index(index_file), False
+
+def _writable(vectorstore):
+    """Give a mapped vectorstore its own in-memory index before it is modified"""
+    index_file = _mapped.pop(vectorstore, None)
+    if index_file is not None:
+        try:
+            index = faiss.read_index(index_file)
+        except RuntimeError:
+            index = None
+        if index is None or index.ntotal != vectorstore.index.ntotal:
+            # File replaced since it was mapped: copy the mapping itself
+            index = faiss.deserialize_index(faiss.serialize_index(vectorstore.index))
+        vectorstore.index = index
+    return vectorstore
+
+def load_vectorstore(path=VECTORSTORE_DIR):
+    """Load an existing vectorstore from disk; chunk text is read lazily by id"""
     try:
-        if not os.path.exists(VECTORSTORE_DIR):
+        index_file = os.path.join(path, "index.faiss")
+        if not os.path.exists(index_file):
             return None
-            
-        embeddings = get_embeddings()
-        vectorstore = FAISS.load_local(
-            VECTORSTORE_DIR, 
-            embeddings, 
-            allow_dangerous_deserialization=True
-        )
+
+        if os.path.exists(os.path.join(path, IDS_FILE)):
+            docstore = ChunkStore(chunk_store_path(path))
+            mapping = read_ids(path)
+        elif os.path.exists(os.path.join(path, LEGACY_CHUNKS_FILE)):
+            # Chunks kept inside the index dir with their positions; re-saved in the current layout
+            docstore = ChunkStore(os.path.join(path, LEGACY_CHUNKS_FILE))
+            mapping = docstore.id_mapping()
+        else:
+            # Pickled docstore (index.pkl) from older versions: never unpickled here.
+            # build_index.py converts these at startup; one still here means it did not run.
+            st.error(f"Index at {path} is in an old format and was not loaded. "
+                     "Convert it with: python migrate_indexes.py")
+            return None
+
+        index, mapped = _read_index(index_file)
+        vectorstore = FAISS(get_embeddings(), index, docstore, mapping)
+        if mapped:
+            _mapped[vectorstore] = index_file
+        load_sparse_index(vectorstore, path)
         return vectorstore
-        
+
     except Exception as e:
         st.error(f"Error loading vectorstore: {str(e)}")
         return None
-    if not os.path.exists(VECTORSTORE_DIR):
-        os.makedirs(VECTORSTORE_DIR)
-    
-    vectorstore.save_local(VECTORSTORE_DIR)
-    
-    return vectorstore
 
+def document_ids(vectorstore):
+    """Document keys whose chunks are present in an index"""
+    return {cid.rsplit("-", 1)[0] for cid in vectorstore.index_to_docstore_id.values()}
 
-def load_vectorstore():
-    """
-    Load existing vectorstore from disk
-    """
-    if not os.path.exists(VECTORSTORE_DIR):
-        raise FileNotFoundError(f"Vectorstore directory '{VECTORSTORE_DIR}' not found")
-    
-    # Create embeddings
-    embeddings = HuggingFaceEmbeddings(
-        model_name=EMBEDDING_MODEL,
-        model_kwargs={'device': 'cpu'},
-        encode_kwargs={'normalize_embeddings': True}
-    )
-    
-    # Load vectorstore
-    vectorstore = FAISS.load_local(
-        VECTORSTORE_DIR,
-        embeddings,
-        allow_dangerous_deserialization=True
+def index_fingerprint(vectorstore):
+    """Stable id for an index's current contents; changes when documents are added or removed"""
+    h = hashlib.sha256()
+    for doc_id in sorted(document_ids(vectorstore)):
+        h.update(doc_id.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()[:16]
+
+def attach_document(vectorstore, doc_vs, doc_id, source=None):
+    """Copy a built document index (from build_document) into vectorstore; returns the vectorstore"""
+    if vectorstore is not None and doc_id in document_ids(vectorstore):
+        return vectorstore
+
+    # Copy the shared per-document chunks, tagged with this upload's name
+    positions = sorted(doc_vs.index_to_docstore_id)
+    ids = [doc_vs.index_to_docstore_id[p] for p in positions]
+    docs = [doc_vs.docstore.search(cid) for cid in ids]
+    metadatas = [{**d.metadata, "source": source} if source else dict(d.metadata) for d in docs]
+
+    if vectorstore is None:
+        index = faiss.deserialize_index(faiss.serialize_index(doc_vs.index))
+        docstore = InMemoryDocstore({
+            cid: type(d)(page_content=d.page_content, metadata=m) for cid, d, m in zip(ids, docs, metadatas)
+        })
+        return FAISS(doc_vs.embedding_function, index, docstore, dict(enumerate(ids)))
+
+    # Works across index types, unlike merge_from; the vectors come from the document's index
+    texts = [d.page_content for d in docs]
+    _writable(vectorstore).add_embeddings(
+        list(zip(texts, index_vectors(doc_vs.index).tolist())),
+        metadatas=metadatas,
+        ids=ids,
     )
-    
+    update_sparse_index(vectorstore, added=zip(ids, texts))
+    update_chunk_catalog(vectorstore, added=zip(ids, metadatas))
+    ensure_index_type(vectorstore)
     return vectorstore
+
+def remove_from_vectorstore(vectorstore, doc_id):
+    """Delete every chunk of one document from an index; returns how many were removed"""
+    ids = [cid for cid in vectorstore.index_to_docstore_id.values()
+           if cid.rsplit("-", 1)[0] == doc_id]
+    if ids:
+        if index_kind(vectorstore.index) == "Flat":
+            _writable(vectorstore)
+        else:
+            # Only Flat renumbers the remaining vectors the way the docstore mapping expects
+            # (HNSW cannot remove at all, IVF keeps the old ids): delete from a flat copy
+            _mapped.pop(vectorstore, None)
+            convert_index(vectorstore, "Flat")
+        vectorstore.delete(ids)
+        ensure_index_type(vectorstore)
+        update_sparse_index(vectorstore, removed=ids)
+        update_chunk_catalog(vectorstore, removed=ids)
+    return len(ids)